@@ -0,0 +1,178 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# Percentile bins for 'accessibility'. Up to EXACT_MAX_ROWS values the edges are
+# exact quantiles; above that they come from mergeable quantile sketches kept per
+# (year, county) instead of a pd.qcut over the fully materialized column
+
+PERCENTILE_LABELS = [
+    "0-20% (Lowest)",
+    "20-40%",
+    "40-60%",
+    "60-80%",
+    "80-100% (Highest)"
+]
+NA_LABEL = "Depopulated Zone"
+# Up to this many values the edges are exact quantiles of the values themselves,
+# the same as pd.qcut; the sketches only take over for larger inputs
+EXACT_MAX_ROWS = 1_000_000
+
+
+class QuantileSketch:
+    """KLL-style quantile sketch: mergeable, bounded size, with a tracked rank-error bound."""
+
+    def __init__(self, k=1024, seed=0):
+        self.k = k
+        self.n = 0
+        # Exact extremes, so the 0 and 1 quantiles never drift
+        self.min = np.inf
+        self.max = -np.inf
+        # levels[h] holds items that each stand for 2**h inputs
+        self.levels = [np.empty(0)]
+        # Worst-case rank error: compacting level h moves any rank by at most 2**h
+        self.max_rank_error = 0
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.n
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += values.size
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._compress()
+        return self
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.max_rank_error += other.max_rank_error
+        self._compress()
+        return self
+
+    def _capacity(self, h):
+        # Lower levels get geometrically smaller buffers (factor 2/3), the top one gets k
+        depth = len(self.levels) - h - 1
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            items = self.levels[h]
+            if items.size > self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # Keep every other item with double weight (seeded random offset, so
+                # results are reproducible); an odd item out stays on this level
+                even = items.size - items.size % 2
+                offset = int(self._rng.integers(2))
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], items[offset:even:2]])
+                self.levels[h] = items[even:]
+                self.max_rank_error += 2 ** h
+            h += 1
+
+    def _weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(level.size, 2 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        return items[order], np.cumsum(weights[order])
+
+    def quantiles(self, qs):
+        # Linear interpolation as in np.quantile / pd.qcut, treating each item as
+        # 'weight' copies of itself; exact while nothing has been compacted
+        if self.n == 0:
+            return np.full(len(qs), np.nan)
+        items, cum_weights = self._weighted_items()
+        positions = np.asarray(qs, dtype=float) * (self.n - 1)
+        lower = np.floor(positions)
+        idx_lower = np.searchsorted(cum_weights, lower, side="right")
+        idx_upper = np.searchsorted(cum_weights, np.ceil(positions), side="right")
+        result = items[idx_lower] + (positions - lower) * (items[idx_upper] - items[idx_lower])
+        result[positions <= 0] = self.min
+        result[positions >= self.n - 1] = self.max
+        return result
+
+    def rank_error_bound(self):
+        # Guaranteed bound on the normalized rank error of any quantile answer
+        return self.max_rank_error / self.n if self.n else 0.0
+
+    def size(self):
+        return sum(level.size for level in self.levels)
+
+
+class AccessibilityBinner:
+    """Bins accessibility, with one QuantileSketch per (year, county) for large inputs."""
+
+    def __init__(self, k=1024, labels=PERCENTILE_LABELS):
+        self.k = k
+        self.labels = list(labels)
+        self.sketches = {}
+
+    def update(self, gdf, value_column="accessibility"):
+        # County key is the 5-digit state+county FIPS prefix of the tract GeoID
+        keys = pd.DataFrame({
+            "year": gdf["year"].to_numpy(),
+            "county": gdf["GeoID"].astype(str).str[:5].to_numpy(),
+            "value": pd.to_numeric(gdf[value_column], errors="coerce").to_numpy(),
+        })
+        for (year, county), group in keys.groupby(["year", "county"], sort=False):
+            key = (int(year), county)
+            if key not in self.sketches:
+                self.sketches[key] = QuantileSketch(k=self.k)
+            self.sketches[key].update(group["value"].to_numpy())
+        return self
+
+    def sketch(self, years=None, counties=None):
+        # Combine the matching per-(year, county) sketches without touching the data
+        combined = QuantileSketch(k=self.k)
+        for (year, county), sketch in self.sketches.items():
+            if (years is None or year in years) and (counties is None or county in counties):
+                combined.merge(sketch)
+        return combined
+
+    def bin_edges(self, years=None, counties=None):
+        qs = np.linspace(0, 1, len(self.labels) + 1)
+        return self.sketch(years, counties).quantiles(qs)
+
+    def assign_bins(self, gdf, mode="pooled", value_column="accessibility", counties=None):
+        # mode="pooled": one set of edges across all years (same as the original qcut);
+        # mode="per_year": each year is ranked against its own distribution
+        values = pd.to_numeric(gdf[value_column], errors="coerce")
+        bins = pd.Series(NA_LABEL, index=gdf.index, dtype=object)
+        if mode == "pooled":
+            groups = [(None, values.notna())]
+        elif mode == "per_year":
+            groups = [([int(year)], values.notna() & (gdf["year"] == year)) for year in gdf["year"].dropna().unique()]
+        else:
+            raise ValueError(f"Unknown binning mode: {mode!r}")
+
+        for years, mask in groups:
+            if not mask.any():
+                continue
+            # Edges come from the rows of the selected counties, as with the sketches
+            reference = mask if counties is None else mask & gdf["GeoID"].astype(str).str[:5].isin(counties)
+            if reference.sum() <= EXACT_MAX_ROWS:
+                qs = np.linspace(0, 1, len(self.labels) + 1)
+                edges = np.quantile(values[reference].to_numpy(dtype=float), qs)
+            else:
+                # Sketches are only built when needed (or were fed through update())
+                if not self.sketches:
+                    self.update(gdf, value_column)
+                edges = self.bin_edges(years, counties)
+            # Open outer edges so values outside the sketched range still get a bin
+            edges[0], edges[-1] = -np.inf, np.inf
+            bins[mask] = pd.cut(values[mask], bins=edges, labels=self.labels, include_lowest=True).astype(str)
+        return bins
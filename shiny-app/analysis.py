@@ -0,0 +1,184 @@
+import os
+import threading
+
+# Income vs. accessibility statistics: per-year correlation and OLS slope with
+# bootstrap confidence intervals. Resamples are drawn as batched index matrices
+# and the batches are spread over a process pool.
+
+BATCH_SIZE = 250
+# Below this many resampled values (rows x resamples) a pool costs more than it saves
+POOL_THRESHOLD = 2_000_000
+STATISTICS = ["pearson_r", "spearman_rho", "slope_per_10k", "intercept"]
+# Result columns; years with fewer than 3 tracts keep NaN in all of them
+ESTIMATE_COLUMNS = (
+    STATISTICS + ["slope_p_value"]
+    + [f"{name}_ci_{bound}" for name in STATISTICS for bound in ("low", "high")]
+)
+
+
+def _resample_ranks(values, counts):
+    import numpy as np
+
+    # Average (tie-aware) ranks each original value would get inside every resample,
+    # from the resample counts alone: no per-resample sort
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+    group_of = np.empty(len(values), dtype=np.intp)
+    group_of[order] = np.cumsum(np.r_[True, sorted_values[1:] != sorted_values[:-1]]) - 1
+    group_counts = np.add.reduceat(counts[:, order], starts, axis=1)
+    group_ranks = np.cumsum(group_counts, axis=1) - group_counts + (group_counts + 1) / 2
+    return group_ranks[:, group_of]
+
+
+def _statistics(x, y, counts):
+    import numpy as np
+
+    # Statistics for every resample at once from weighted sums; counts[b, i] is how
+    # often row i was drawn, so each sum is a matrix-vector product
+    n = len(x)
+    weights = counts.astype(float)
+    sx, sy = weights @ x, weights @ y
+    sxy = weights @ (x * y) - sx * sy / n
+    sxx = weights @ (x * x) - sx * sx / n
+    syy = weights @ (y * y) - sy * sy / n
+
+    # Spearman is Pearson on the within-resample ranks, whose mean is always (n + 1) / 2
+    rank_x, rank_y = _resample_ranks(x, counts), _resample_ranks(y, counts)
+    weighted_rank_x = weights * rank_x
+    offset = n * ((n + 1) / 2) ** 2
+    rxy = np.einsum("ij,ij->i", weighted_rank_x, rank_y) - offset
+    rxx = np.einsum("ij,ij->i", weighted_rank_x, rank_x) - offset
+    ryy = np.einsum("ij,ij->i", weights * rank_y, rank_y) - offset
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = sxy / sxx
+        return np.column_stack([
+            sxy / np.sqrt(sxx * syy),
+            rxy / np.sqrt(rxx * ryy),
+            slope,
+            (sy - slope * sx) / n,
+        ])
+
+
+def bootstrap_batch(x, y, n_resamples, seed):
+    import numpy as np
+
+    # One (n_resamples, n) index matrix per batch instead of a Python loop per
+    # resample, reduced to per-row draw counts
+    rng = np.random.default_rng(seed)
+    n = len(x)
+    idx = rng.integers(0, n, size=(n_resamples, n))
+    counts = np.bincount((idx + n * np.arange(n_resamples)[:, None]).ravel(), minlength=n_resamples * n)
+    return _statistics(x, y, counts.reshape(n_resamples, n))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # Spawned (not forked) workers, since the app process runs threads
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def bootstrap(x, y, n_resamples=2000, seed=0, use_pool=None):
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    batches = [BATCH_SIZE] * (n_resamples // BATCH_SIZE)
+    if n_resamples % BATCH_SIZE:
+        batches.append(n_resamples % BATCH_SIZE)
+    # Independent, reproducible streams per batch
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+
+    if use_pool is None:
+        use_pool = len(x) * n_resamples >= POOL_THRESHOLD
+    if use_pool:
+        pool = get_pool()
+        futures = [pool.submit(bootstrap_batch, x, y, size, s) for size, s in zip(batches, seeds)]
+        results = [f.result() for f in futures]
+    else:
+        results = [bootstrap_batch(x, y, size, s) for size, s in zip(batches, seeds)]
+    return np.vstack(results)
+
+
+def point_estimates(x, y):
+    import statsmodels.api as sm
+    from scipy import stats
+
+    ols = sm.OLS(y, sm.add_constant(x)).fit()
+    return {
+        "pearson_r": stats.pearsonr(x, y).statistic,
+        "spearman_rho": stats.spearmanr(x, y).statistic,
+        "slope_per_10k": ols.params[1],
+        "intercept": ols.params[0],
+        "slope_p_value": ols.pvalues[1],
+    }
+
+
+def income_accessibility_stats(merged_gdf, years=None, county=None, income_bins=None, city=None,
+                               n_resamples=2000, confidence=0.95, seed=0):
+    import numpy as np
+    import pandas as pd
+
+    # Same filters as the app's pages: county FIPS, income bins and city
+    df = merged_gdf
+    if county is not None:
+        df = df[df["GeoID"].astype(str).str[:5] == county]
+    if income_bins is not None:
+        df = df[df["mu_income_bins_label"].isin(list(income_bins))]
+    if city is not None and city != "All":
+        df = df[df["city"].apply(lambda cities: city in cities if isinstance(cities, list) else city == cities)]
+
+    alpha = (1 - confidence) / 2
+    rows = []
+    for year in sorted(df["year"].unique()) if years is None else years:
+        sample = df[df["year"] == year][["mu_income", "accessibility"]].astype(float).dropna()
+        row = {"year": int(year), "n": len(sample), **dict.fromkeys(ESTIMATE_COLUMNS, np.nan)}
+        if len(sample) >= 3:
+            # Income in $10k so the slope reads as accessibility per $10k of mean earnings
+            x = sample["mu_income"].to_numpy() / 10_000
+            y = sample["accessibility"].to_numpy()
+            row.update(point_estimates(x, y))
+            resamples = bootstrap(x, y, n_resamples=n_resamples, seed=seed)
+            low, high = np.nanquantile(resamples, [alpha, 1 - alpha], axis=0)
+            for i, name in enumerate(STATISTICS):
+                row[f"{name}_ci_low"] = low[i]
+                row[f"{name}_ci_high"] = high[i]
+        rows.append(row)
+    return pd.DataFrame(rows, columns=["year", "n"] + ESTIMATE_COLUMNS)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def cached_stats(merged_gdf, county=None, income_bins=None, city=None, n_resamples=2000):
+    import pandas as pd
+
+    # One cache entry per (dataset, year, county, filter); changing a filter only
+    # recomputes the years that were never requested with it
+    filter_key = (county, tuple(sorted(income_bins)) if income_bins is not None else None, city, n_resamples)
+    rows = []
+    for year in sorted(merged_gdf["year"].unique()):
+        key = (id(merged_gdf), int(year)) + filter_key
+        with _cache_lock:
+            row = _cache.get(key)
+        if row is None:
+            row = income_accessibility_stats(
+                merged_gdf, years=[year], county=county, income_bins=income_bins,
+                city=city, n_resamples=n_resamples,
+            )
+            with _cache_lock:
+                _cache[key] = row
+        rows.append(row)
+    return pd.concat(rows, ignore_index=True)
@@ -0,0 +1,184 @@
+import hashlib
+
+import orjson
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from dataset import build_metadata
+
+# JSON data API mounted beside the Shiny app under /api. Selections use the same
+# filters as the app (year, income bins, city). Every response carries an ETag
+# from the dataset version and the query, so a repeat fetch is a 304.
+#   GET /api/metadata
+#   GET /api/tracts?year=2024&income_bins=Low,Middle&city=Pasadena&geometry=true&simplify=0.0005
+#   GET /api/summary?year=2024&income_bins=Low,Middle&city=All
+
+ATTRIBUTE_COLUMNS = [
+    "GeoID", "year", "city", "num_pop", "mu_income", "mu_income_bins_label", "mu_income_bins_range",
+    "unique_station_count", "ev_level1_evse_num", "ev_level2_evse_num", "ev_dc_fast_num",
+    "accessibility", "accessibility_bins",
+]
+# Selections with more rows than this are streamed in chunks of CHUNK_ROWS
+STREAM_THRESHOLD = 1000
+CHUNK_ROWS = 500
+JSON_MEDIA_TYPE = "application/json"
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def dumps(value):
+    # NaN becomes null; numpy scalars are serialized natively, pd.NA as null
+    return orjson.dumps(value, default=lambda _: None, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def parse_filters(params):
+    try:
+        year = int(params["year"]) if "year" in params else None
+    except ValueError:
+        raise BadRequest("'year' must be an integer") from None
+    income_bins = params["income_bins"].split(",") if params.get("income_bins") else None
+    city = params.get("city") or None
+    return year, income_bins, city
+
+
+def select_tracts(merged_gdf, year=None, income_bins=None, city=None):
+    # Same filters as the app's pages
+    mask = merged_gdf["year"].notna()
+    if year is not None:
+        mask &= merged_gdf["year"] == year
+    if income_bins is not None:
+        mask &= merged_gdf["mu_income_bins_label"].isin(income_bins)
+    if city is not None and city != "All":
+        mask &= merged_gdf["city"].apply(
+            lambda cities: city in cities if isinstance(cities, list) else city == cities
+        )
+    return merged_gdf[mask]
+
+
+def summarize(tracts):
+    population = tracts["num_pop"].astype(float)
+    by_income_bin = tracts.groupby("mu_income_bins_label", observed=True).agg(
+        tracts=("GeoID", "nunique"),
+        population=("num_pop", "sum"),
+        stations=("unique_station_count", "sum"),
+    )
+    return {
+        "tracts": int(tracts["GeoID"].nunique()),
+        "population": float(population.sum()),
+        "mean_income": float(tracts["mu_income"].astype(float).mean()),
+        "stations": float(tracts["unique_station_count"].astype(float).sum()),
+        "level1_evse": float(tracts["ev_level1_evse_num"].astype(float).sum()),
+        "level2_evse": float(tracts["ev_level2_evse_num"].astype(float).sum()),
+        "dc_fast_evse": float(tracts["ev_dc_fast_num"].astype(float).sum()),
+        "mean_accessibility": float(tracts["accessibility"].astype(float).mean()),
+        "by_income_bin": {
+            label: {k: float(v) for k, v in row.items()}
+            for label, row in by_income_bin.to_dict("index").items()
+        },
+    }
+
+
+def geojson_geometries(tracts, simplify):
+    import shapely
+    from shared_dataset import as_geodataframe
+
+    # RFC 7946 GeoJSON is WGS 84; the geometry strings are embedded as-is
+    geometry = as_geodataframe(tracts).geometry.to_crs(epsg=4326)
+    if simplify > 0:
+        geometry = geometry.simplify(simplify, preserve_topology=True)
+    return [orjson.Fragment(g) if g is not None else None for g in shapely.to_geojson(geometry.to_numpy())]
+
+
+def tract_records(tracts, with_geometry=False, simplify=0.0):
+    columns = [c for c in ATTRIBUTE_COLUMNS if c in tracts.columns]
+    records = tracts[columns].to_dict("records")
+    if with_geometry:
+        for record, geometry in zip(records, geojson_geometries(tracts, simplify)):
+            record["geometry"] = geometry
+    return records
+
+
+def stream_records(tracts, with_geometry, simplify, header):
+    # Serialize one chunk at a time so the full body is never held in memory
+    yield header[:-1] + b',"rows":['
+    for start in range(0, len(tracts), CHUNK_ROWS):
+        chunk = dumps(tract_records(tracts.iloc[start:start + CHUNK_ROWS], with_geometry, simplify))
+        yield (b"," if start else b"") + chunk[1:-1]
+    yield b"]}"
+
+
+class DataAPI:
+    """Request handlers over the app's DatasetLoader."""
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def etag(self, request):
+        # Weak: the gzip middleware may change the bytes, not the content
+        query = sorted(request.query_params.multi_items())
+        digest = hashlib.sha1(dumps([self.loader.version, request.url.path, query])).hexdigest()[:20]
+        return f'W/"{digest}"'
+
+    def respond(self, request, build):
+        status = self.loader.status()
+        if status != "ready":
+            return Response(dumps({"status": status}), status_code=503 if status == "loading" else 500,
+                            media_type=JSON_MEDIA_TYPE)
+
+        # Conditional GET: a matching ETag is answered before touching the data
+        etag = self.etag(request)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+            return Response(status_code=304, headers=headers)
+        try:
+            return build(self.loader.get(), request.query_params, headers)
+        except BadRequest as e:
+            return Response(dumps({"error": str(e)}), status_code=400, media_type=JSON_MEDIA_TYPE)
+
+    def metadata(self, request):
+        def build(merged_gdf, params, headers):
+            body = {"version": self.loader.version, **build_metadata(merged_gdf)}
+            return Response(dumps(body), headers=headers, media_type=JSON_MEDIA_TYPE)
+        return self.respond(request, build)
+
+    def summary(self, request):
+        def build(merged_gdf, params, headers):
+            year, income_bins, city = parse_filters(params)
+            body = {"version": self.loader.version, **summarize(select_tracts(merged_gdf, year, income_bins, city))}
+            return Response(dumps(body), headers=headers, media_type=JSON_MEDIA_TYPE)
+        return self.respond(request, build)
+
+    def tracts(self, request):
+        def build(merged_gdf, params, headers):
+            year, income_bins, city = parse_filters(params)
+            with_geometry = params.get("geometry", "false").lower() in ("1", "true", "yes")
+            try:
+                simplify = float(params.get("simplify", 0))
+            except ValueError:
+                raise BadRequest("'simplify' must be a number (degrees)") from None
+
+            tracts = select_tracts(merged_gdf, year, income_bins, city)
+            header = dumps({"version": self.loader.version, "count": len(tracts)})
+            if len(tracts) > STREAM_THRESHOLD:
+                return StreamingResponse(stream_records(tracts, with_geometry, simplify, header),
+                                         headers=headers, media_type=JSON_MEDIA_TYPE)
+            body = header[:-1] + b',"rows":' + dumps(tract_records(tracts, with_geometry, simplify)) + b"}"
+            return Response(body, headers=headers, media_type=JSON_MEDIA_TYPE)
+        return self.respond(request, build)
+
+
+def api_app(loader):
+    handlers = DataAPI(loader)
+    return Starlette(
+        routes=[
+            Route("/metadata", handlers.metadata),
+            Route("/summary", handlers.summary),
+            Route("/tracts", handlers.tracts),
+        ],
+        middleware=[Middleware(GZipMiddleware, minimum_size=1000)],
+    )
@@ -1,230 +1,71 @@
-import shiny
-from shiny import App, ui, render
-
-import geopandas as gpd
-import pandas as pd
-import matplotlib.pyplot as plt
-import contextily as ctx
-from matplotlib.colors import ListedColormap
-from matplotlib import colors as mcolors
+import asyncio
 import os
-import numpy as np
-
-# Data Preparation
-import geopandas as gpd
-import pandas as pd
-
-def prepare_data():
-    # Load the GeoDataFrame
-    data_path = "../data/ev_final_demo_merged.geojson"
-    gdf = gpd.read_file(data_path)
-
-    # Drop rows where 'num_pop' is NaN and where 'num_pop' is 0
-    gdf = gdf.dropna(subset=['num_pop'])
-    gdf = gdf[gdf['num_pop'] > 0]
-
-    # Ensure all values in 'groups_with_access_code' are lowercase
-    gdf['groups_with_access_code'] = gdf['groups_with_access_code'].str.lower()
-
-    # Assign 'time_acess' = 1 if 'groups_with_access_code' contains '24 hours'
-    gdf['time_acess'] = gdf['groups_with_access_code'].apply(lambda x: 1 if '24 hours' in x else 0)
-
-    # Assign 'nonpublic_acess' = 1 if 'groups_with_access_code' contains 'required' or 'only'
-    gdf['nonpublic_acess'] = gdf['groups_with_access_code'].apply(lambda x: 1 if 'required' in x or 'only' in x else 0)
-
-    # Path to the full census tract shapefile
-    census_tract_path = "/Volumes/Nancy/data/tl_2024_06_tract/tl_2024_06_tract.shp"
-
-    # Load the shapefile
-    tracts = gpd.read_file(census_tract_path)
-
-    # Filter for LA County using the FIPS code ('037' for Los Angeles)
-    la_tracts = tracts[tracts['COUNTYFP'] == '037']
-
-    # Group by 'GeoID' and 'year', apply specific aggregation rules
-    gdf = (
-        gdf.groupby(['GeoID', 'year'])
-        .agg(
-            unique_station_count=('station_name', 'nunique'),
-            num_pop=('num_pop', 'first'),
-            num_pop_m=('num_pop_m', 'first'),
-            num_pop_f=('num_pop_f', 'first'),
-            num_pop_25_to_34=('num_pop_25_to_34', 'first'),
-            num_pop_18=('num_pop_18', 'first'),
-            num_pop_21=('num_pop_21', 'first'),
-            num_pop_62=('num_pop_62', 'first'),
-            mu_income=('mu_income', 'first'),
-            geometry=('geometry', lambda x: list(x.unique())),  # Collect all unique geometry values as a list
-            area=('area', 'first'),
-            city=('city', lambda x: list(x.unique()) if x.nunique() > 1 else x.iloc[0]),
-            ev_level1_evse_num=('ev_level1_evse_num', 'sum'),
-            ev_level2_evse_num=('ev_level2_evse_num', 'sum'),
-            ev_dc_fast_num=('ev_dc_fast_num', 'sum'),
-            time_acess=('time_acess', 'sum'),
-            nonpublic_acess=('nonpublic_acess', 'sum'),
-        )
-        .reset_index()
-    )
-
-    # Drop unnecessary columns directly in the grouped DataFrame
-    columns_to_drop_group = ['zip', 'groups_with_access_code', 'access_days_time', 'status_code', 'street_address','geometry']
-    gdf = gdf.drop(columns=columns_to_drop_group, errors='ignore')
-
-    numeric_columns = ['ev_level1_evse_num','ev_level2_evse_num', 'ev_dc_fast_num', 
-                   'time_acess','nonpublic_acess',
-                   'unique_station_count']
-    gdf[numeric_columns] = gdf[numeric_columns].fillna(0)
-
-    # Calculate 'accessibility', handle cases where 'num_pop' is 0 or NA
-    gdf['accessibility'] = gdf.apply(
-        lambda row: (row['unique_station_count'] / row['num_pop']) * 1000 
-        if pd.notna(row['num_pop']) and row['num_pop'] != 0 else np.nan,
-        axis=1
-    )
-
-    # Define the percentile-based bins
-    num_bins = 5
-    percentile_labels = [
-        "0-20% (Lowest)",
-        "20-40%",
-        "40-60%",
-        "60-80%",
-        "80-100% (Highest)"
-    ]
-
-    # Separate NA values and non-NA values for 'accessibility'
-    na_mask = gdf['accessibility'].isna()
-
-    # Calculate percentile bins for numeric (non-NA) values
-    gdf.loc[~na_mask, 'accessibility_bins'] = pd.qcut(
-        gdf.loc[~na_mask, 'accessibility'], 
-        q=num_bins, 
-        labels=percentile_labels
-    )
-
-    # Assign 'Depopulated Zone' label for NA values
-    gdf['accessibility_bins'] = gdf['accessibility_bins'].astype('category')
-    gdf['accessibility_bins'] = gdf['accessibility_bins'].cat.add_categories(['Depopulated Zone'])
-    gdf.loc[na_mask, 'accessibility_bins'] = 'Depopulated Zone'
-
-    # Final step: Optionally convert to string for uniformity (if needed for export)
-    gdf['accessibility_bins'] = gdf['accessibility_bins'].astype('str')
-
-    # Convert 'mu_income' to numeric
-    gdf['mu_income'] = pd.to_numeric(gdf['mu_income'], errors='coerce')
-
-    # Create a mask for NA values in 'mu_income'
-    na_mask_income = gdf['mu_income'].isna()
-
-    # Define bins for 'mu_income'
-    num_bins_income = 5
-    income_bins = pd.cut(
-        gdf.loc[~na_mask_income, 'mu_income'],  # Only consider non-NA values
-        bins=num_bins_income,
-        precision=2
-    )
-
-    # Extract range categories for non-NA values
-    bin_ranges = income_bins.cat.categories
-
-    # Map bin ranges to descriptive labels
-    bin_labels = ["Low", "Middle Low", "Middle", "Middle High", "High"]
-    bin_mapping = {i: label for i, label in enumerate(bin_labels)}
-
-    # Assign bin indices for non-NA values
-    gdf.loc[~na_mask_income, 'mu_income_bins'] = pd.cut(
-        gdf.loc[~na_mask_income, 'mu_income'], 
-        bins=num_bins_income, 
-        precision=2, 
-        labels=range(num_bins_income)
-    ).astype(float)
-
-    # Assign bin range and label for non-NA values
-    gdf.loc[~na_mask_income, 'mu_income_bins_range'] = pd.cut(
-        gdf.loc[~na_mask_income, 'mu_income'], 
-        bins=num_bins_income, 
-        precision=2
-    ).astype(str)
-
-    gdf.loc[~na_mask_income, 'mu_income_bins_label'] = pd.cut(
-        gdf.loc[~na_mask_income, 'mu_income'], 
-        bins=num_bins_income, 
-        precision=2, 
-        labels=bin_labels
-    ).astype(str)
-
-    # Assign 'Depopulated Zone' to NA values
-    gdf.loc[na_mask_income, 'mu_income_bins'] = np.nan
-    gdf.loc[na_mask_income, 'mu_income_bins_range'] = 'Depopulated Zone'
-    gdf.loc[na_mask_income, 'mu_income_bins_label'] = 'Depopulated Zone'
-
-    # Convert 'mu_income_bins_label' to categorical type with specified order
-    gdf['mu_income_bins_label'] = pd.Categorical(
-        gdf['mu_income_bins_label'], 
-        categories=bin_labels + ['Depopulated Zone'], 
-        ordered=True
-    )
-
-    # Optionally convert ranges and labels to string for export
-    gdf['mu_income_bins_range'] = gdf['mu_income_bins_range'].astype(str)
-    gdf['mu_income_bins_label'] = gdf['mu_income_bins_label'].astype(str)
-
-
-    # Aggregate data by year and bins
-    income_bins_data = gdf.groupby(['year', 'mu_income_bins_label']).size().reset_index(name='count')
-
-    # Filter the data to include only the years 2022, 2023, and 2024
-    filtered_data = income_bins_data[income_bins_data['year'].isin([2022, 2023, 2024])]
+from types import SimpleNamespace
+
+from shiny import App, ui, render, reactive, req
+from shiny.types import SafeException
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+from dataset import DatasetLoader, build_metadata, load_dataset, read_metadata
+from shared_dataset import as_geodataframe, is_stale, load_shared
+from tract_lookup import click_to_3857, lookup_for
+from siting import model_for
+from analysis import cached_stats
+from catalog import (
+    CANNED_QUERIES, MAX_QUERY_ROWS, TRACT_YEAR_PATH, QueryError, available_queries, get_connection,
+    guarded_query, materialize_tract_year, reset_connection,
+)
+from station_diff import CHANGE_TYPES, get_changes
+from api import api_app
 
-    # Merge gdf data onto LA County tracts (keep all LA tracts)
-    merged_gdf = la_tracts.merge(gdf, left_on='GEOID', right_on='GeoID', how='left')
 
-    # Merge gdf data onto LA County tracts (keep all LA tracts)
-    merged_gdf = la_tracts.merge(gdf, left_on='GEOID', right_on='GeoID', how='outer')
+# Plotting libraries are only needed once a map is rendered, so they are
+# imported on first use instead of at startup
+def plotting_libs():
+    import matplotlib.pyplot as plt
+    import contextily as ctx
+    from matplotlib.colors import ListedColormap
+    from matplotlib import colors as mcolors
+    if not BASEMAP:
+        # Same interface as contextily, minus the tile downloads
+        ctx = SimpleNamespace(providers=ctx.providers, add_basemap=lambda ax, **kwargs: None)
+    return plt, ctx, ListedColormap, mcolors
 
-    merged_gdf = merged_gdf.set_geometry('geometry')
-    merged_gdf["year"] = merged_gdf["year"].astype("Int64").dropna() 
-    
-    return merged_gdf
 
+# EV_APP_BASEMAP=0 draws the maps without web map tiles (offline runs, load tests)
+BASEMAP = os.environ.get("EV_APP_BASEMAP", "1") != "0"
 
-# Prepare data once at the start
-merged_gdf = prepare_data()
 
-# Clean and validate the 'year' column
-merged_gdf = merged_gdf[merged_gdf["year"].notna()]  # Drop rows with NaN in 'year'
-merged_gdf["year"] = merged_gdf["year"].astype(int)  # Convert 'year' to integers
+# Startup mode: "background" binds the port right away and loads the dataset
+# on a worker thread; "eager" loads it before the app is created
+STARTUP_MODE = os.environ.get("EV_APP_STARTUP", "background")
 
+# With EV_APP_SHARED_DATASET=1 the dataset is published once as a memory-mapped
+# Arrow file and every uvicorn worker maps the same physical copy
+SHARED_DATASET = os.environ.get("EV_APP_SHARED_DATASET") == "1"
 
-# Generate dropdown choices as strings
-year_choices = [str(year) for year in sorted(merged_gdf["year"].unique())]
+loader = DatasetLoader(load=load_shared if SHARED_DATASET else load_dataset)
+metadata = read_metadata()
+if STARTUP_MODE == "eager":
+    loader.load()
+    metadata = build_metadata(loader.get())
+else:
+    loader.start()
 
-# Accessibility colormap
-reds_cmap = plt.cm.Reds
-num_bins = 5
-percentile_labels = [
-    "0-20% (Lowest)",
-    "20-40%",
-    "40-60%",
-    "60-80%",
-    "80-100% (Highest)"
-]
-red_colors = [reds_cmap(i) for i in np.linspace(0.4, 1, num_bins)]  # Lighter to darker shades
-accessibility_colors = dict(zip(percentile_labels, red_colors))
-accessibility_colors["Depopulated Zone"] = "grey" 
+# Generate dropdown choices as strings. Without precomputed metadata (a first boot
+# that skipped 'python dataset.py') the port is still bound right away: the
+# dropdowns start empty and the server fills them in once the dataset has loaded
+METADATA_PENDING = metadata is None
+year_choices = metadata["year_choices"] if metadata else []
+city_choices = metadata["city_choices"] if metadata else ["All"]
 
-# Extract unique cities for the dropdown
-def extract_unique_cities(city_column):
-    unique_cities = set()  # Use a set to avoid duplicates
-    for value in city_column.dropna():  # Drop NA values
-        if isinstance(value, list):  # If the value is a list
-            unique_cities.update(value)  # Add all cities in the list to the set
-        else:  # If it's a single city (not a list)
-            unique_cities.add(value)
-    return sorted(unique_cities)  # Return sorted list of unique cities
 
-# Get unique cities
-city_choices = ["All"] + extract_unique_cities(merged_gdf["city"])
+def default_year(choices, last=False):
+    # 2024 when available, otherwise the first (or last) year
+    if "2024" in choices:
+        return "2024"
+    return (choices[-1] if last else choices[0]) if choices else None
 
 
 page1 = ui.navset_card_underline(
@@ -237,7 +78,7 @@ page1 = ui.navset_card_underline(
                     id="year",
                     label="Select Year:",
                     choices=year_choices,
-                    selected="2024" if "2024" in year_choices else year_choices[0],
+                    selected=default_year(year_choices),
                 ),
                 # Multi-select dropdown for income bins
                 ui.input_checkbox_group(
@@ -278,17 +119,21 @@ page1 = ui.navset_card_underline(
             ui.layout_columns(
                 ui.card(
                     #ui.card_header("Income Levels", class_="text-center fw-bold fs-5"),
-                    ui.output_plot("map_plot"),  # Map for Income Levels
+                    ui.output_plot("map_plot", click=True),  # Map for Income Levels
                     full_screen=True,
                 ),
                 ui.card(
                     #ui.card_header("Accessibility", class_="text-center fw-bold fs-5"),
-                    ui.output_plot("accessibility_map_plot"),  # Map for Accessibility
+                    ui.output_plot("accessibility_map_plot", click=True),  # Map for Accessibility
                     full_screen=True,
                 ),
                 col_widths=(6, 6),  # Maps occupy more space
                 style="height: calc(100vh - 300px);"  # Dynamic height adjustment
             ),
+            ui.card(
+                ui.card_header("Selected Tract (click a map)", class_="text-center fw-bold"),
+                ui.output_data_frame("clicked_tract"),
+            ),
         ),
     ),
     title="Income and EV Charger Accessibility",
@@ -338,21 +183,202 @@ page2 = ui.navset_card_underline(
             ),
             ui.layout_columns(
                 ui.card(
-                    ui.output_plot("city_income_map"),
+                    ui.output_plot("city_income_map", click=True),
                     full_screen=True,
                 ),
                 ui.card(
-                    ui.output_plot("city_accessibility_map"),
+                    ui.output_plot("city_accessibility_map", click=True),
                     full_screen=True,
                 ),
                 col_widths=(6, 6),
                 style="height: calc(100vh - 300px);",
             ),
+            ui.card(
+                ui.card_header("Selected Tract (click a map)", class_="text-center fw-bold"),
+                ui.output_data_frame("clicked_tract_city"),
+            ),
         ),
     ),
     title="City Level Analysis of Income and Accessibility",
 )
 
+page3 = ui.navset_card_underline(
+    ui.nav_panel(
+        "Aggregate Queries",
+        ui.layout_sidebar(
+            ui.sidebar(
+                # Dropdown for selecting a catalog query
+                ui.input_select(
+                    id="query_name",
+                    label="Select Query:",
+                    choices=list(CANNED_QUERIES),
+                ),
+                # Ad-hoc read-only SQL over the catalog views
+                ui.input_text_area(
+                    id="custom_sql",
+                    label="Or Run a SELECT:",
+                    placeholder="SELECT year, count(*) FROM tract_year GROUP BY year",
+                    rows=6,
+                ),
+                ui.input_action_button("run_sql", "Run Query"),
+                ui.help_text(f"Views: population, income, stations, tract_year, station_changes. "
+                             f"At most {MAX_QUERY_ROWS:,} rows."),
+            ),
+            ui.card(
+                ui.output_data_frame("query_result"),
+                full_screen=True,
+            ),
+        ),
+    ),
+    title="Data Catalog Queries",
+)
+
+page4 = ui.navset_card_underline(
+    ui.nav_panel(
+        "Charger Siting",
+        ui.layout_sidebar(
+            ui.sidebar(
+                # Dropdown for selecting year
+                ui.input_select(
+                    id="year_siting",
+                    label="Select Year:",
+                    choices=year_choices,
+                    selected=default_year(year_choices, last=True),
+                ),
+                # Number of new charger sites to propose
+                ui.input_numeric(
+                    id="num_sites",
+                    label="Number of New Sites:",
+                    value=25,
+                    min=1,
+                    max=500,
+                ),
+                ui.input_slider(
+                    id="coverage_radius",
+                    label="Coverage Radius (km):",
+                    min=0.5,
+                    max=10,
+                    value=2,
+                    step=0.5,
+                ),
+                # Extra weight for people in the Low / Middle Low income bins
+                ui.input_slider(
+                    id="equity_weight",
+                    label="Extra Weight for Low-Income Tracts:",
+                    min=0,
+                    max=5,
+                    value=1,
+                    step=0.5,
+                ),
+            ),
+            ui.layout_columns(
+                ui.card(
+                    ui.card_header("Population Coverage", class_="text-center fw-bold"),
+                    ui.div(ui.output_text("siting_coverage"), class_="small-card"),
+                ),
+                ui.card(
+                    ui.card_header("Low-Income Population Coverage", class_="text-center fw-bold"),
+                    ui.div(ui.output_text("siting_low_income_coverage"), class_="small-card"),
+                ),
+                col_widths=(6, 6),
+            ),
+            ui.layout_columns(
+                ui.card(
+                    ui.output_plot("siting_map"),
+                    full_screen=True,
+                ),
+                ui.card(
+                    ui.output_data_frame("siting_table"),
+                    full_screen=True,
+                ),
+                col_widths=(6, 6),
+                style="height: calc(100vh - 300px);",
+            ),
+        ),
+    ),
+    title="Proposed Charger Locations",
+)
+
+page5 = ui.navset_card_underline(
+    ui.nav_panel(
+        "Income vs. Accessibility",
+        ui.layout_sidebar(
+            ui.sidebar(
+                # Multi-select for income bins
+                ui.input_checkbox_group(
+                    id="stats_income_bins",
+                    label="Select Income Bins:",
+                    choices=["Low", "Middle Low", "Middle", "Middle High", "High"],
+                    selected=["Low", "Middle Low", "Middle", "Middle High", "High"],
+                ),
+                # Dropdown for selecting city
+                ui.input_select(
+                    id="stats_city",
+                    label="Select City:",
+                    choices=city_choices,
+                    selected="All",
+                ),
+                # Number of bootstrap resamples per year
+                ui.input_select(
+                    id="stats_resamples",
+                    label="Bootstrap Resamples:",
+                    choices=["1000", "2000", "5000"],
+                    selected="2000",
+                ),
+            ),
+            ui.layout_columns(
+                ui.card(
+                    ui.output_plot("stats_plot"),
+                    full_screen=True,
+                ),
+                ui.card(
+                    ui.output_data_frame("stats_table"),
+                    full_screen=True,
+                ),
+                col_widths=(6, 6),
+                style="height: calc(100vh - 150px);",
+            ),
+        ),
+    ),
+    title="Correlation and Regression with 95% Bootstrap Intervals",
+)
+
+page6 = ui.navset_card_underline(
+    ui.nav_panel(
+        "Station Changes",
+        ui.layout_sidebar(
+            ui.sidebar(
+                # Pair of consecutive snapshots; choices are filled in once the change log is loaded
+                ui.input_select(
+                    id="changes_period",
+                    label="Select Snapshots:",
+                    choices=[],
+                ),
+                # Multi-select for change types
+                ui.input_checkbox_group(
+                    id="change_types",
+                    label="Select Changes:",
+                    choices={"added": "Added", "removed": "Removed", "evse_changed": "EVSE Count Changed"},
+                    selected=CHANGE_TYPES,
+                ),
+            ),
+            ui.layout_columns(
+                ui.card(
+                    ui.output_plot("changes_map"),
+                    full_screen=True,
+                ),
+                ui.card(
+                    ui.output_data_frame("changes_table"),
+                    full_screen=True,
+                ),
+                col_widths=(6, 6),
+                style="height: calc(100vh - 150px);",
+            ),
+        ),
+    ),
+    title="What Changed Between Station Snapshots",
+)
+
 
 # Main UI: Include all pages in the navbar
 app_ui = ui.page_fillable(
@@ -415,15 +441,43 @@ app_ui = ui.page_fillable(
     ui.page_navbar(
         ui.nav_panel("Page 1", page1),
         ui.nav_panel("Page 2", page2),
+        ui.nav_panel("Page 3", page3),
+        ui.nav_panel("Page 4", page4),
+        ui.nav_panel("Page 5", page5),
+        ui.nav_panel("Page 6", page6),
+        id="page",
         title="EV Charger Accessibility Analysis"
     )
 )
 
 # Server logic
 def server(input, output, session):
+    @reactive.calc
+    def dataset():
+        # Outputs stay blank until the background load finishes
+        if loader.status() == "loading":
+            reactive.invalidate_later(0.5)
+            req(False)
+        return loader.get()
+
+    if METADATA_PENDING:
+        @reactive.effect
+        def _():
+            # The UI was built before the dataset existed: fill in its dropdowns
+            choices = build_metadata(dataset())
+            years = choices["year_choices"]
+            ui.update_select("year", choices=years, selected=default_year(years))
+            ui.update_select("year_page2", choices=years, selected=default_year(years))
+            ui.update_select("year_siting", choices=years, selected=default_year(years, last=True))
+            cities = choices["city_choices"]
+            ui.update_select("city", choices=cities,
+                             selected="Rancho Palos Verdes" if "Rancho Palos Verdes" in cities else "All")
+            ui.update_select("stats_city", choices=cities, selected="All")
+
     @output
     @render.text
     def income_range():
+        merged_gdf = dataset()
         # Get selected income bins
         selected_bins = input.income_bins()
         if not selected_bins:
@@ -456,6 +510,7 @@ def server(input, output, session):
     @output
     @render.text
     def accessibility_range():
+        merged_gdf = dataset()
         # Filter data by year and selected bins
         filtered_gdf = merged_gdf[
             (merged_gdf["year"] == int(input.year())) &
@@ -495,6 +550,7 @@ def server(input, output, session):
     @output
     @render.text
     def unique_geoids():
+        merged_gdf = dataset()
         # Filter data by year and selected bins
         filtered_gdf = merged_gdf[
             (merged_gdf["year"] == int(input.year())) &
@@ -507,11 +563,13 @@ def server(input, output, session):
     @output
     @render.plot
     def map_plot():
+        merged_gdf = dataset()
+        plt, ctx, ListedColormap, mcolors = plotting_libs()
         # Filter the data by year and selected bins
-        filtered_gdf = merged_gdf[
+        filtered_gdf = as_geodataframe(merged_gdf[
             (merged_gdf["year"] == int(input.year())) &
             (merged_gdf["mu_income_bins_label"].isin(input.income_bins()))
-        ].to_crs(epsg=3857)
+        ]).to_crs(epsg=3857)
 
         # Define custom colors for income bins
         custom_colors = {
@@ -566,6 +624,8 @@ def server(input, output, session):
     @output
     @render.plot
     def accessibility_map_plot():
+        merged_gdf = dataset()
+        plt, ctx, ListedColormap, mcolors = plotting_libs()
         accessibility_colors = {
             "Depopulated Zone": "#cccccc",  # grey for Depopulated Zone
             "0-20% (Lowest)": "#9ACBEA",  # blue
@@ -575,10 +635,10 @@ def server(input, output, session):
             "80-100% (Highest)": "#E34234"  # dark red
         }
         # Filter the data by year and selected bins
-        filtered_gdf = merged_gdf[
+        filtered_gdf = as_geodataframe(merged_gdf[
             (merged_gdf["year"] == int(input.year())) &
             (merged_gdf["mu_income_bins_label"].isin(input.income_bins()))
-        ].to_crs(epsg=3857)
+        ]).to_crs(epsg=3857)
 
         # Ensure categories of 'mu_income_bins_label' match the order of custom_colors
         merged_gdf['accessibility_bins'] = merged_gdf['accessibility_bins'].astype('category')
@@ -621,6 +681,7 @@ def server(input, output, session):
     @output
     @render.text
     def income_range_city():
+        merged_gdf = dataset()
         # Get selected city and year
         selected_city = input.city()
         selected_year = int(input.year_page2())
@@ -671,6 +732,7 @@ def server(input, output, session):
     @output
     @render.text
     def accessibility_range_city():
+        merged_gdf = dataset()
         # Get selected city and year
         selected_city = input.city()
         selected_year = int(input.year_page2())
@@ -722,6 +784,7 @@ def server(input, output, session):
     @output
     @render.text
     def unique_geoids_city():
+        merged_gdf = dataset()
         # Debug: Print the 'city' column and its types
         print(merged_gdf["city"].head())
         print(merged_gdf["city"].apply(type).unique())
@@ -749,6 +812,8 @@ def server(input, output, session):
     @output
     @render.plot
     def city_income_map():
+        merged_gdf = dataset()
+        plt, ctx, ListedColormap, mcolors = plotting_libs()
         # Filter by selected city and year
         selected_city = input.city()
         selected_year = int(input.year_page2())
@@ -793,7 +858,7 @@ def server(input, output, session):
         )
 
         # Reproject to EPSG:3857 for basemap compatibility
-        filtered_gdf = filtered_gdf.to_crs(epsg=3857)
+        filtered_gdf = as_geodataframe(filtered_gdf).to_crs(epsg=3857)
 
         # Plot the map
         fig, ax = plt.subplots(figsize=(10, 8))
@@ -827,6 +892,8 @@ def server(input, output, session):
     @output
     @render.plot
     def city_accessibility_map():
+        merged_gdf = dataset()
+        plt, ctx, ListedColormap, mcolors = plotting_libs()
         # Filter by selected city and year
         selected_city = input.city()
         selected_year = int(input.year_page2())
@@ -871,7 +938,7 @@ def server(input, output, session):
         )
 
         # Reproject to EPSG:3857 for basemap compatibility
-        filtered_gdf = filtered_gdf.to_crs(epsg=3857)
+        filtered_gdf = as_geodataframe(filtered_gdf).to_crs(epsg=3857)
 
         # Plot the accessibility map
         fig, ax = plt.subplots(figsize=(10, 8))
@@ -902,5 +969,327 @@ def server(input, output, session):
 
 
 
+    @reactive.calc
+    def query_catalog():
+        # Materialize the processed tract-year table for DuckDB once the dataset is loaded
+        merged_gdf = dataset()
+        if is_stale(TRACT_YEAR_PATH, loader.version):
+            materialize_tract_year(as_geodataframe(merged_gdf), version=loader.version)
+            reset_connection()
+        return get_connection()
+
+    @reactive.calc
+    def catalog_queries():
+        # Canned queries whose views exist; 'stations' and 'station_changes' only
+        # exist after 'python catalog.py build'
+        return available_queries(query_catalog())
+
+    @reactive.effect
+    def _():
+        req(input.page() == "Page 3")
+        queries = catalog_queries()
+        with reactive.isolate():
+            selected = input.query_name()
+        ui.update_select("query_name", choices=queries,
+                         selected=selected if selected in queries else next(iter(queries), None))
+
+    # Which query the table shows: the selected canned query, or the last custom SELECT
+    custom_query = reactive.value(None)
+
+    @reactive.effect
+    @reactive.event(input.run_sql)
+    def _():
+        custom_query.set(input.custom_sql().strip() or None)
+
+    @reactive.effect
+    @reactive.event(input.query_name)
+    def _():
+        custom_query.set(None)
+
+    @output
+    @render.data_frame
+    def query_result():
+        con = query_catalog()
+        sql = custom_query.get()
+        if sql is None:
+            req(input.query_name() in catalog_queries())
+            return con.cursor().execute(CANNED_QUERIES[input.query_name()]).df()
+        try:
+            return guarded_query(sql)
+        except QueryError as e:
+            # Shown to the user even when other errors are sanitized
+            raise SafeException(str(e)) from None
+
+
+    # Most recent click on any map, as EPSG:3857 coordinates
+    clicked_point = reactive.value(None)
+
+    def track_clicks(click_input):
+        @reactive.effect
+        @reactive.event(click_input)
+        def _():
+            clicked_point.set(click_to_3857(click_input()))
+
+    for click_input in (input.map_plot_click, input.accessibility_map_plot_click,
+                        input.city_income_map_click, input.city_accessibility_map_click):
+        track_clicks(click_input)
+
+    @reactive.calc
+    def clicked_tract_details():
+        point = clicked_point.get()
+        req(point)
+        # STRtree lookup over the cached projected tract geometry
+        lookup = lookup_for(dataset())
+        geoid = lookup.geoid_at(*point)
+        req(geoid)  # Clicks outside every tract leave the table empty
+        return lookup.details(geoid)
+
+    @output
+    @render.data_frame
+    def clicked_tract():
+        return clicked_tract_details()
+
+    @output
+    @render.data_frame
+    def clicked_tract_city():
+        return clicked_tract_details()
+
+    @reactive.calc
+    def siting_result():
+        # Lazy-greedy maximum coverage over the cached sparse coverage matrix
+        model = model_for(dataset())
+        req(input.num_sites())
+        return model.propose(
+            int(input.year_siting()),
+            k=int(input.num_sites()),
+            radius=float(input.coverage_radius()) * 1000,
+            equity_weight=float(input.equity_weight()),
+        )
+
+    @output
+    @render.text
+    def siting_coverage():
+        _, _, summary = siting_result()
+        return f"{summary['coverage_before']:.1%} → {summary['coverage_after']:.1%}"
+
+    @output
+    @render.text
+    def siting_low_income_coverage():
+        _, _, summary = siting_result()
+        return f"{summary['low_income_coverage_before']:.1%} → {summary['low_income_coverage_after']:.1%}"
+
+    @output
+    @render.data_frame
+    def siting_table():
+        sites, _, _ = siting_result()
+        table = sites.drop(columns="centroid")
+        table["city"] = table["city"].map(lambda c: ", ".join(c) if isinstance(c, list) else c)
+        return table.round(0)
+
+    @output
+    @render.plot
+    def siting_map():
+        plt, ctx, ListedColormap, mcolors = plotting_libs()
+        sites, tracts, _ = siting_result()
+
+        # Define colors for coverage status
+        coverage_colors = {
+            "Existing": "#CFE8F5",  # Light blue
+            "New": "#E34234",  # Dark red
+            "Uncovered": "#cccccc",  # Grey
+        }
+        # Ensure categories of 'coverage_status' match the order of colors
+        # (the model works in metres; the basemap is Web Mercator)
+        tracts = tracts.drop(columns="centroid").to_crs(epsg=3857)
+        sites = sites.to_crs(epsg=3857)
+        tracts["coverage_status"] = tracts["coverage_status"].astype("category")
+        tracts["coverage_status"] = tracts["coverage_status"].cat.set_categories(
+            list(coverage_colors.keys()), ordered=True
+        )
+        cmap = ListedColormap([coverage_colors[label] for label in coverage_colors])
+
+        # Plot the coverage map
+        fig, ax = plt.subplots(figsize=(10, 8))
+        fig.patch.set_alpha(0)
+        tracts.plot(
+            column="coverage_status",
+            cmap=cmap,
+            linewidth=0.2,
+            edgecolor="white",
+            legend=True,
+            ax=ax,
+        )
+        # Proposed sites on top
+        sites.plot(ax=ax, color="black", marker="x", markersize=30)
+
+        ctx.add_basemap(ax, source=ctx.providers.CartoDB.Voyager)
+        ax.set_facecolor('none')
+        legend = ax.get_legend()
+        if legend:
+            legend.set_bbox_to_anchor((1.5, 0.5))
+            legend.set_frame_on(False)
+            legend.set_title("Charger Coverage")
+
+        ax.set_title(f"Proposed Charger Sites ({input.year_siting()})", fontsize=16)
+        ax.axis("off")
+        return fig
+
+    @reactive.extended_task
+    async def bootstrap_stats(merged_gdf, income_bins, city, n_resamples):
+        # Cold runs take seconds; a worker thread keeps the event loop (and every
+        # other session on this process) responsive meanwhile
+        return await asyncio.to_thread(
+            cached_stats, merged_gdf, income_bins=income_bins, city=city, n_resamples=n_resamples,
+        )
+
+    @reactive.effect
+    def _():
+        # Bootstrap results are cached per (year, county, filter) across sessions.
+        # Runs only while Page 5 is shown; a new filter combination replaces a run
+        # that is still in progress
+        req(input.page() == "Page 5", input.stats_income_bins())
+        merged_gdf = dataset()
+        bootstrap_stats.cancel()
+        bootstrap_stats.invoke(
+            merged_gdf,
+            income_bins=tuple(input.stats_income_bins()),
+            city=input.stats_city(),
+            n_resamples=int(input.stats_resamples()),
+        )
+
+    @reactive.calc
+    def income_accessibility():
+        return bootstrap_stats.result()
+
+    @output
+    @render.data_frame
+    def stats_table():
+        return income_accessibility().round(4)
+
+    @output
+    @render.plot
+    def stats_plot():
+        plt, ctx, ListedColormap, mcolors = plotting_libs()
+        results = income_accessibility().dropna(subset=["pearson_r"])
+        # Every year may have fewer than 3 tracts (e.g. a small city)
+        req(len(results))
+
+        fig, axes = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
+        fig.patch.set_alpha(0)
+        for ax, name, title in [
+            (axes[0], "pearson_r", "Pearson Correlation (Income vs. Accessibility)"),
+            (axes[1], "slope_per_10k", "OLS Slope (Accessibility per $10k Income)"),
+        ]:
+            # Point estimates with asymmetric bootstrap interval error bars
+            ax.errorbar(
+                results["year"],
+                results[name],
+                yerr=[results[name] - results[f"{name}_ci_low"], results[f"{name}_ci_high"] - results[name]],
+                fmt="o-",
+                color="#E34234",
+                ecolor="#9ACBEA",
+                capsize=4,
+            )
+            ax.axhline(0, color="grey", linewidth=0.5)
+            ax.set_facecolor('none')
+            ax.set_title(title, fontsize=14)
+        axes[1].set_xlabel("Year")
+        return fig
+
+    @reactive.extended_task
+    async def change_log():
+        # The first load may materialize the station snapshots and build the log,
+        # which takes seconds; a worker thread keeps the event loop responsive
+        return await asyncio.to_thread(get_changes)
+
+    @reactive.effect
+    @reactive.event(input.page)
+    def _():
+        # Loaded once Page 6 has been opened, not at session start
+        if input.page() == "Page 6" and change_log.status() == "initial":
+            change_log.invoke()
+
+    @reactive.calc
+    def station_changes():
+        # Change log from fingerprint diffs of consecutive station snapshots, shared by all sessions
+        return change_log.result()
+
+    @reactive.effect
+    def _():
+        changes = station_changes()
+        periods = [f"{a}-{b}" for a, b in changes[["from_year", "to_year"]].drop_duplicates().itertuples(index=False)]
+        ui.update_select("changes_period", choices=periods, selected=periods[-1] if periods else None)
+
+    @reactive.calc
+    def period_changes():
+        req(input.changes_period())
+        from_year, to_year = map(int, input.changes_period().split("-"))
+        changes = station_changes()
+        return changes[
+            (changes["from_year"] == from_year)
+            & (changes["to_year"] == to_year)
+            & changes["change"].isin(input.change_types())
+        ]
+
+    @output
+    @render.data_frame
+    def changes_table():
+        changes = period_changes()
+        return changes[[
+            "change", "station_name", "street_address", "city", "ev_network",
+            "stations_before", "stations_after", "evse_delta",
+        ]].sort_values(["change", "evse_delta"])
+
+    @output
+    @render.plot
+    def changes_map():
+        import geopandas as gpd
+
+        plt, ctx, ListedColormap, mcolors = plotting_libs()
+        changes = period_changes()
+        req(len(changes))
+        points = gpd.GeoDataFrame(
+            changes,
+            geometry=gpd.points_from_xy(changes["longitude"], changes["latitude"]),
+            crs="EPSG:4326",
+        ).to_crs(epsg=3857)
+
+        # Define colors for change types
+        change_colors = {
+            "added": "#2E8B57",  # Green
+            "removed": "#E34234",  # Dark red
+            "evse_changed": "#F2A900",  # Amber
+        }
+        change_labels = {"added": "Added", "removed": "Removed", "evse_changed": "EVSE Count Changed"}
+
+        # Plot the change map, one layer per change type
+        fig, ax = plt.subplots(figsize=(10, 8))
+        fig.patch.set_alpha(0)
+        for change, color in change_colors.items():
+            layer = points[points["change"] == change]
+            if len(layer):
+                layer.plot(ax=ax, color=color, markersize=8, alpha=0.7, label=change_labels[change])
+
+        ctx.add_basemap(ax, source=ctx.providers.CartoDB.Voyager)
+        ax.set_facecolor('none')
+        ax.legend(loc="center left", bbox_to_anchor=(1.0, 0.5), frameon=False, title="Station Changes")
+
+        ax.set_title(f"Station Changes ({input.changes_period()})", fontsize=16)
+        ax.axis("off")
+        return fig
+
+# Readiness probe: 503 while the dataset is loading, 200 once it is available
+def healthz(request):
+    status = loader.status()
+    status_codes = {"loading": 503, "ready": 200, "error": 500}
+    return JSONResponse(
+        {"status": status, "load_seconds": loader.load_seconds},
+        status_code=status_codes[status],
+    )
+
+
 # Create the app
 app = App(app_ui, server)
+app.starlette_app.router.routes.insert(0, Route("/healthz", healthz))
+# JSON data API (see api.py) beside the Shiny app
+app.starlette_app.router.routes.insert(1, Mount("/api", app=api_app(loader)))
@@ -0,0 +1,307 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# Benchmarks for the Shiny app. Run from the shiny-app directory:
+#   python benchmark.py
+# Every result is printed as "<name>: <value>" so runs can be compared across commits.
+
+
+def report(name, value, unit="s"):
+    if isinstance(value, float):
+        print(f"{name}: {value:.4f} {unit}".rstrip())
+    else:
+        print(f"{name}: {value}")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return True
+        except OSError:
+            time.sleep(0.01)
+    return False
+
+
+def healthz(port):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as resp:
+            return json.load(resp)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+    except OSError:
+        return {"status": "unreachable"}
+
+
+def bench_startup(mode="background", timeout=600):
+    # Time to import the app module in a fresh interpreter
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            env={**os.environ, "EV_APP_STARTUP": mode})
+    if result.returncode != 0:
+        # e.g. eager mode without the prepared data files
+        report(f"startup.{mode}.import", "failed")
+        return
+    report(f"startup.{mode}.import", float(result.stdout.split()[-1]))
+
+    # Time until the port accepts connections, and until the readiness probe settles
+    port = free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, "EV_APP_STARTUP": mode},
+    )
+    try:
+        if not wait_for_port(port, timeout):
+            report(f"startup.{mode}.bind", "timeout")
+            return
+        report(f"startup.{mode}.bind", time.perf_counter() - started)
+
+        status = healthz(port)
+        while status["status"] == "loading" and time.perf_counter() - started < timeout:
+            time.sleep(0.05)
+            status = healthz(port)
+        report(f"startup.{mode}.ready", time.perf_counter() - started)
+        report(f"startup.{mode}.dataset_status", status["status"])
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def bench_shared_dataset():
+    import pyarrow as pa
+    from shared_dataset import SHARED_PATH, open_shared
+
+    if not os.path.exists(SHARED_PATH):
+        report("shared.open", "skipped (no published dataset)")
+        return
+    # Mapping should cost neither time nor private memory, whatever the dataset size
+    allocated = pa.total_allocated_bytes()
+    started = time.perf_counter()
+    df = open_shared(SHARED_PATH)
+    report("shared.open", time.perf_counter() - started)
+    report("shared.rows", len(df))
+    report("shared.file_mb", os.path.getsize(SHARED_PATH) / 2**20, "MB")
+    report("shared.private_mb", (pa.total_allocated_bytes() - allocated) / 2**20, "MB")
+
+
+def bench_quantile_binning(n=5_000_000, chunks=500):
+    import numpy as np
+    import pandas as pd
+    from accessibility_binning import PERCENTILE_LABELS, QuantileSketch
+
+    # Streamed synthetic accessibility values, roughly national station-snapshot scale
+    values = np.random.default_rng(0).lognormal(size=n)
+    sketch = QuantileSketch()
+    started = time.perf_counter()
+    for chunk in np.array_split(values, chunks):
+        sketch.update(chunk)
+    report("binning.sketch_update", time.perf_counter() - started)
+    report("binning.sketch_items", sketch.size())
+
+    qs = np.linspace(0, 1, len(PERCENTILE_LABELS) + 1)
+    edges = sketch.quantiles(qs)
+    observed = np.abs(np.searchsorted(np.sort(values), edges) / n - qs).max()
+    report("binning.rank_error_bound", sketch.rank_error_bound(), "")
+    report("binning.rank_error_observed", observed, "")
+
+    started = time.perf_counter()
+    exact = pd.qcut(values, q=len(PERCENTILE_LABELS), labels=PERCENTILE_LABELS)
+    report("binning.exact_qcut", time.perf_counter() - started)
+    edges[0], edges[-1] = -np.inf, np.inf
+    approx = pd.cut(values, bins=edges, labels=PERCENTILE_LABELS)
+    report("binning.label_mismatch", float(np.mean(np.asarray(approx) != np.asarray(exact))), "")
+
+
+def bench_catalog():
+    from catalog import CANNED_QUERIES, QueryError, available_queries, connect, guarded_query
+
+    started = time.perf_counter()
+    con = connect()
+    report("catalog.connect", time.perf_counter() - started)
+    available = available_queries(con)
+    for name, sql in CANNED_QUERIES.items():
+        if name not in available:
+            report(f"catalog.query[{name}]", "skipped (views missing, run 'python catalog.py build')")
+            continue
+        started = time.perf_counter()
+        con.execute(sql).fetchall()
+        report(f"catalog.query[{name}]", time.perf_counter() - started)
+
+    # Ad-hoc SQL must not reach files outside the views, quoted paths included
+    for sql in ['SELECT * FROM "../requests.jsonl"', "SELECT * FROM read_text('catalog.py')"]:
+        try:
+            guarded_query(sql)
+            report(f"catalog.guard[{sql}]", "NOT REJECTED")
+        except QueryError:
+            report(f"catalog.guard[{sql}]", "rejected")
+
+
+def synthetic_tracts(side=100, years=8, seed=0):
+    import geopandas as gpd
+    import numpy as np
+    from shapely import box
+
+    # Grid of side x side 1 km "tracts" in California Albers starting at downtown LA,
+    # repeated for each year
+    rng = np.random.default_rng(seed)
+    x0, y0 = 158_000, -436_000
+    cells = [box(x0 + i * 1000, y0 + j * 1000, x0 + (i + 1) * 1000, y0 + (j + 1) * 1000)
+             for i in range(side) for j in range(side)]
+    rows = len(cells) * years
+    return gpd.GeoDataFrame(
+        {
+            "GeoID": [f"06037{n:06d}" for n in range(len(cells))] * years,
+            "year": np.repeat(np.arange(2024 - years + 1, 2025), len(cells)),
+            "city": "Los Angeles",
+            "num_pop": rng.integers(500, 8000, rows),
+            "mu_income_bins_label": rng.choice(["Low", "Middle Low", "Middle", "Middle High", "High"], rows),
+            "unique_station_count": rng.poisson(0.3, rows),
+        },
+        geometry=cells * years,
+        crs="EPSG:3310",
+    )
+
+
+def bench_tract_lookup(lookups=10_000):
+    import numpy as np
+    from tract_lookup import TractLookup
+
+    gdf = synthetic_tracts()
+    started = time.perf_counter()
+    lookup = TractLookup(gdf)
+    report("lookup.build", time.perf_counter() - started)
+
+    # Clicks arrive in the maps' Web Mercator coordinates; some land outside the
+    # (projected, slightly rotated) grid, like clicks on the basemap
+    xmin, ymin, xmax, ymax = gdf.to_crs(epsg=3857).total_bounds
+    points = np.random.default_rng(0).uniform((xmin, ymin), (xmax, ymax), size=(lookups, 2))
+    started = time.perf_counter()
+    for x, y in points:
+        geoid = lookup.geoid_at(x, y)
+        if geoid is not None:
+            lookup.details(geoid)
+    report("lookup.per_click", (time.perf_counter() - started) / lookups * 1000, "ms")
+
+
+def bench_siting(k=300):
+    from siting import SitingModel
+
+    # 10k tracts, about four times LA County
+    model = SitingModel(synthetic_tracts(years=1))
+    started = time.perf_counter()
+    model.coverage(2024, 1500)
+    report("siting.coverage_matrix", time.perf_counter() - started)
+    started = time.perf_counter()
+    _, _, summary = model.propose(2024, k, radius=1500, equity_weight=1)
+    report(f"siting.propose_k{k}", time.perf_counter() - started)
+    report("siting.coverage_gain", summary["coverage_after"] - summary["coverage_before"], "")
+
+
+def bench_bootstrap(n=2500, n_resamples=5000):
+    import numpy as np
+    from analysis import bootstrap
+
+    # One county-year of tracts with a weak income/accessibility relationship
+    rng = np.random.default_rng(0)
+    x = rng.uniform(2, 25, n)
+    y = 0.05 * x + rng.exponential(1, n)
+    for use_pool in (False, True):
+        label = "pool" if use_pool else "serial"
+        bootstrap(x, y, n_resamples=250, use_pool=use_pool)  # spawn workers outside the timing
+        started = time.perf_counter()
+        bootstrap(x, y, n_resamples=n_resamples, use_pool=use_pool)
+        report(f"bootstrap.{label}_{n_resamples}", time.perf_counter() - started)
+
+
+def bench_station_diff():
+    import pandas as pd
+    from station_diff import build_change_log, diff_snapshots, snapshot_paths
+
+    snapshots = snapshot_paths()
+    if len(snapshots) < 2:
+        report("station_diff", "skipped (run 'python catalog.py build' first)")
+        return
+    # The two most recent statewide snapshots, read outside the timing
+    (from_year, before_path), (to_year, after_path) = list(snapshots.items())[-2:]
+    before, after = pd.read_parquet(before_path), pd.read_parquet(after_path)
+    started = time.perf_counter()
+    changes = diff_snapshots(before, after, from_year, to_year)
+    report(f"station_diff.diff_{from_year}_{to_year}", time.perf_counter() - started)
+    for change, count in changes["change"].value_counts().items():
+        report(f"station_diff.{change}", int(count))
+    started = time.perf_counter()
+    build_change_log()
+    report("station_diff.build_change_log", time.perf_counter() - started)
+
+
+def bench_crosswalk(side=100, years=6):
+    import geopandas as gpd
+    from shapely import box
+    from crosswalk import AREA_CRS, Crosswalk
+
+    # 2010-style 1 km tracts onto an offset 0.7 km grid, as if tracts were split
+    def grid(size, offset, prefix):
+        n = int(side * 1000 / size)
+        cells = [box(offset + i * size, offset + j * size, offset + (i + 1) * size, offset + (j + 1) * size)
+                 for i in range(n) for j in range(n)]
+        return gpd.GeoDataFrame({"GEOID": [f"{prefix}{k:06d}" for k in range(len(cells))]}, geometry=cells, crs=AREA_CRS)
+
+    source, target = grid(1000, 0, "06037"), grid(700, 350, "06037")
+    started = time.perf_counter()
+    crosswalk = Crosswalk.build(source, target)
+    report("crosswalk.build", time.perf_counter() - started)
+    report("crosswalk.nonzero_weights", crosswalk.weights.nnz)
+
+    tracts = synthetic_tracts(side=side, years=years)
+    started = time.perf_counter()
+    for year, rows in tracts.drop(columns="geometry").groupby("year"):
+        reallocated = crosswalk.reallocate(rows.drop(columns="year"))
+    report(f"crosswalk.reallocate_{years}_years", time.perf_counter() - started)
+    # Source tracts that fall fully inside the target grid keep their totals
+    report("crosswalk.population_ratio", reallocated["num_pop"].sum() / rows["num_pop"].sum(), "")
+
+
+def bench_api():
+    from api import dumps, stream_records
+
+    # Full tract selection (one year of a 100 x 100 grid), attributes only and with geometry
+    tracts = synthetic_tracts(years=1)
+    for with_geometry in (False, True):
+        label = "geometry" if with_geometry else "attributes"
+        header = dumps({"version": "", "count": len(tracts)})
+        started = time.perf_counter()
+        size = sum(len(chunk) for chunk in stream_records(tracts, with_geometry, 0.0, header))
+        report(f"api.tracts_{label}", time.perf_counter() - started)
+        report(f"api.tracts_{label}_mb", size / 2**20, "MB")
+
+
+def main():
+    bench_startup("background")
+    bench_startup("eager")
+    bench_shared_dataset()
+    bench_quantile_binning()
+    bench_catalog()
+    bench_tract_lookup()
+    bench_siting()
+    bench_bootstrap()
+    bench_station_diff()
+    bench_crosswalk()
+    bench_api()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import csv
+import glob
+import json
+import os
+import re
+import sys
+import threading
+
+from dataset import CENSUS_TRACT_PATH
+
+# Embedded DuckDB catalog over the raw census/station files and the processed
+# tract-year data. Views are created on connect, so nothing runs until queried.
+# Usage (from the shiny-app directory):
+#   python catalog.py build
+#   python catalog.py query "SELECT year, count(*) FROM population GROUP BY year"
+#   python catalog.py query "EVSE by income bin and year"   (a CANNED_QUERIES name)
+RAW_DATA_DIR = "../raw_data"
+PARQUET_DIR = os.environ.get("EV_APP_PARQUET_DIR", "../data/parquet")
+TRACT_YEAR_PATH = os.path.join(PARQUET_DIR, "tract_year.parquet")
+
+# Normalized column name -> ACS header, per source. Headers changed wording over
+# the years (e.g. "18 years and over" vs "Total population!!18 years and over")
+POPULATION_COLUMNS = {
+    "num_pop": r"Estimate!!SEX AND AGE!!Total population",
+    "num_pop_m": r"Estimate!!SEX AND AGE!!Total population!!Male",
+    "num_pop_f": r"Estimate!!SEX AND AGE!!Total population!!Female",
+    "num_pop_25_to_34": r"Estimate!!SEX AND AGE!!Total population!!25 to 34 years",
+    "num_pop_18": r"Estimate!!SEX AND AGE!!(Total population!!)?18 years and over",
+    "num_pop_21": r"Estimate!!SEX AND AGE!!(Total population!!)?21 years and over",
+    "num_pop_62": r"Estimate!!SEX AND AGE!!(Total population!!)?62 years and over",
+}
+INCOME_COLUMNS = {
+    "mu_income": r"Estimate!!INCOME AND BENEFITS .*Mean earnings \(dollars\)",
+}
+STATION_COLUMNS = [
+    "id", "station_name", "street_address", "city", "zip", "ev_network",
+    "ev_level1_evse_num", "ev_level2_evse_num", "ev_dc_fast_num",
+    "groups_with_access_code", "access_days_time", "status_code", "open_date",
+]
+
+# Aggregates offered in the app's query panel
+CANNED_QUERIES = {
+    "EVSE by income bin and year": """
+        SELECT year, mu_income_bins_label AS income_bin,
+               count(DISTINCT GeoID) AS tracts,
+               sum(ev_level1_evse_num) AS level1_evse,
+               sum(ev_level2_evse_num) AS level2_evse,
+               sum(ev_dc_fast_num) AS dc_fast_evse,
+               round(avg(accessibility), 3) AS mean_accessibility
+        FROM tract_year
+        GROUP BY year, mu_income_bins_label
+        ORDER BY year, list_position(['Low', 'Middle Low', 'Middle', 'Middle High', 'High'], mu_income_bins_label)
+    """,
+    "Stations by network and snapshot": """
+        SELECT snapshot_year, coalesce(ev_network, 'Unknown') AS ev_network,
+               count(*) AS stations,
+               sum(coalesce(ev_level2_evse_num, 0) + coalesce(ev_dc_fast_num, 0)) AS evse
+        FROM stations
+        WHERE GeoID LIKE '06037%'
+        GROUP BY ALL
+        ORDER BY snapshot_year, stations DESC
+    """,
+    "Population and mean income by year": """
+        SELECT p.year, count(*) AS tracts, sum(p.num_pop) AS population,
+               round(avg(i.mu_income)) AS mean_income
+        FROM population p LEFT JOIN income i USING (GeoID, year)
+        GROUP BY ALL
+        ORDER BY p.year
+    """,
+    "Station changes by network": """
+        SELECT from_year, to_year, coalesce(ev_network, 'Unknown') AS ev_network,
+               count(*) FILTER (WHERE change = 'added') AS added,
+               count(*) FILTER (WHERE change = 'removed') AS removed,
+               count(*) FILTER (WHERE change = 'evse_changed') AS evse_changed,
+               sum(evse_delta) AS evse_delta
+        FROM station_changes
+        GROUP BY ALL
+        ORDER BY from_year, to_year, added + removed + evse_changed DESC
+    """,
+}
+
+# Limits for ad-hoc queries from the app
+MAX_QUERY_ROWS = 10_000
+QUERY_TIMEOUT = 10  # seconds
+USAGE = 'usage: python catalog.py build | python catalog.py query "<SQL or canned query name>"'
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _census_select(path, columns):
+    # One SELECT per yearly file: map its headers onto the normalized names
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        header = next(csv.reader(f))
+    selected = []
+    for name, pattern in columns.items():
+        match = next((h for h in header if re.fullmatch(pattern, h)), None)
+        expr = f"TRY_CAST({_quote_identifier(match)} AS DOUBLE)" if match else "CAST(NULL AS DOUBLE)"
+        selected.append(f"{expr} AS {name}")
+    # The header is already known, so skip DuckDB's CSV sniffing and read everything as text
+    column_types = ", ".join(f"{_quote_literal(h)}: 'VARCHAR'" for h in header)
+    return (
+        "SELECT regexp_extract(GeoID, 'US(\\d{11})$', 1) AS GeoID, "
+        "TRY_CAST(year AS INTEGER) AS year, " + ", ".join(selected) + " "
+        f"FROM read_csv({_quote_literal(path)}, header = true, auto_detect = false, "
+        f"delim = ',', quote = '\"', columns = {{{column_types}}}) "
+        "WHERE GeoID LIKE '1400000US%'"
+    )
+
+
+def _census_paths(prefix, raw_dir):
+    return sorted(glob.glob(os.path.join(raw_dir, "us_census_data", f"{prefix}_*.csv")))
+
+
+def _census_view(paths, columns):
+    return "\nUNION ALL\n".join(_census_select(path, columns) for path in paths)
+
+
+def materialize_stations(raw_dir=RAW_DATA_DIR, out_dir=PARQUET_DIR, tracts_path=CENSUS_TRACT_PATH):
+    # Zipped GeoJSON snapshots -> one Parquet file per snapshot year, with GeoID
+    # from a spatial join when the tract shapefile is available
+    import geopandas as gpd
+    import pandas as pd
+
+    os.makedirs(out_dir, exist_ok=True)
+    tracts = None
+    for zip_path in sorted(glob.glob(os.path.join(raw_dir, "charging_station_data", "*.geojson.zip"))):
+        year = int(re.search(r"(\d{4})\)", zip_path).group(1))
+        out_path = os.path.join(out_dir, f"stations_{year}.parquet")
+        if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(zip_path):
+            continue
+
+        inner = os.path.basename(zip_path)[:-len(".zip")]
+        stations = gpd.read_file(f"/vsizip/{os.path.abspath(zip_path)}/{inner}")
+        if tracts is None and os.path.exists(tracts_path):
+            tracts = gpd.read_file(tracts_path, columns=["GEOID"])
+        if tracts is not None:
+            stations = gpd.sjoin(stations.to_crs(tracts.crs), tracts, how="left", predicate="within")
+            stations = stations.rename(columns={"GEOID": "GeoID"}).to_crs(epsg=4326)
+        else:
+            stations["GeoID"] = None
+
+        table = pd.DataFrame(stations[STATION_COLUMNS + ["GeoID"]])
+        table["longitude"] = stations.geometry.x
+        table["latitude"] = stations.geometry.y
+        table["snapshot_year"] = year
+        table.to_parquet(out_path, index=False)
+
+
+def materialize_tract_year(merged_gdf, path=TRACT_YEAR_PATH, version=None):
+    import pyarrow.parquet as pq
+    from shared_dataset import to_arrow_table
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(to_arrow_table(merged_gdf, version), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def connect(raw_dir=RAW_DATA_DIR, parquet_dir=PARQUET_DIR, sandboxed=False):
+    # A sandboxed connection can read only the files behind its views: no other
+    # paths (quoted or through table functions), ATTACH, COPY or extensions
+    import duckdb
+
+    con = duckdb.connect()
+    sources = []
+    for name, prefix, columns in [("population", "pop", POPULATION_COLUMNS), ("income", "inc", INCOME_COLUMNS)]:
+        paths = _census_paths(prefix, raw_dir)
+        con.execute(f"CREATE VIEW {name} AS {_census_view(paths, columns)}")
+        sources += paths
+
+    # Parquet-backed views get projection and predicate pushdown from DuckDB. One
+    # scan per file, since a sandboxed connection cannot expand globs
+    station_paths = sorted(glob.glob(os.path.join(parquet_dir, "stations_*.parquet")))
+    if station_paths:
+        scans = "\nUNION ALL BY NAME\n".join(f"SELECT * FROM read_parquet({_quote_literal(p)})" for p in station_paths)
+        con.execute(f"CREATE VIEW stations AS {scans}")
+        sources += station_paths
+    for name, filename in [("tract_year", os.path.basename(TRACT_YEAR_PATH)), ("station_changes", "station_changes.parquet")]:
+        path = os.path.join(parquet_dir, filename)
+        if os.path.exists(path):
+            con.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet({_quote_literal(path)})")
+            sources.append(path)
+
+    if sandboxed:
+        allowed = ", ".join(_quote_literal(os.path.abspath(p)) for p in sources)
+        con.execute(f"SET allowed_paths = [{allowed}]")
+        con.execute("SET enable_external_access = false")
+        con.execute("SET lock_configuration = true")
+    return con
+
+
+def table_references(con, sql):
+    # Tables and table functions a query reads, from DuckDB's parse tree (parsing
+    # only: nothing is bound or read). Names defined by WITH are not tables
+    tree = json.loads(con.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+    if tree["error"]:
+        raise QueryError(tree["error_message"])
+    tables, functions, ctes = set(), set(), set()
+
+    def walk(node):
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, dict):
+            if node.get("type") == "BASE_TABLE":
+                tables.add(node["table_name"])
+            elif node.get("type") == "TABLE_FUNCTION":
+                functions.add(node["function"]["function_name"])
+            ctes.update(entry["key"] for entry in (node.get("cte_map") or {}).get("map", []))
+            for value in node.values():
+                walk(value)
+
+    walk(tree["statements"])
+    return tables - ctes, functions
+
+
+def view_names(con):
+    return {name for (name,) in con.execute("SELECT view_name FROM duckdb_views() WHERE NOT internal").fetchall()}
+
+
+def available_queries(con):
+    # Canned queries whose views exist (stations and changes need 'build' first)
+    views = view_names(con)
+    return [name for name, sql in CANNED_QUERIES.items() if table_references(con, sql)[0] <= views]
+
+
+_connections = {}
+_connection_lock = threading.Lock()
+
+
+def get_connection(sandboxed=False):
+    # One shared connection of each kind per process; callers take a cursor per query
+    with _connection_lock:
+        if sandboxed not in _connections:
+            _connections[sandboxed] = connect(sandboxed=sandboxed)
+        return _connections[sandboxed]
+
+
+def query(sql, params=None):
+    return get_connection().cursor().execute(sql, params).df()
+
+
+def guarded_query(sql):
+    # One read-only SELECT over the views, capped in rows and interrupted after
+    # QUERY_TIMEOUT seconds. It runs on the sandboxed connection, so anything that
+    # slips past the checks below still cannot touch other files
+    import duckdb
+
+    con = get_connection(sandboxed=True)
+    try:
+        statements = con.extract_statements(sql)
+        if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+            raise QueryError("Only a single SELECT statement is allowed")
+        tables, functions = table_references(con, sql)
+    except duckdb.Error as e:
+        raise QueryError(str(e)) from None
+    views = view_names(con)
+    if functions or not tables <= views:
+        rejected = sorted(tables - views) + [f"{f}()" for f in sorted(functions)]
+        raise QueryError(f"Queries can only read the catalog views ({', '.join(sorted(views))}), "
+                         f"not {', '.join(rejected)}")
+
+    cursor = con.cursor()
+    timer = threading.Timer(QUERY_TIMEOUT, cursor.interrupt)
+    timer.start()
+    try:
+        return cursor.execute(f"SELECT * FROM ({sql.strip().rstrip(';')}) LIMIT {MAX_QUERY_ROWS}").df()
+    except duckdb.Error as e:
+        raise QueryError(str(e)) from None
+    finally:
+        timer.cancel()
+
+
+def reset_connection():
+    # Re-create views after new Parquet files were materialized
+    with _connection_lock:
+        _connections.clear()
+
+
+def main(argv):
+    import pandas as pd
+
+    command = argv[1] if len(argv) > 1 else "build"
+    if command not in ("build", "query") or (command == "query" and len(argv) < 3):
+        raise SystemExit(USAGE)
+    if command == "build":
+        from dataset import build_metadata, load_dataset, write_metadata
+        from station_diff import build_change_log
+
+        materialize_stations()
+        build_change_log()
+        merged_gdf = load_dataset()
+        materialize_tract_year(merged_gdf)
+        # The app's dropdown metadata comes from the same load
+        write_metadata(build_metadata(merged_gdf))
+        return
+    sql = CANNED_QUERIES.get(argv[2], argv[2])
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(query(sql))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
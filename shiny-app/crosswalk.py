@@ -0,0 +1,218 @@
+import os
+import threading
+
+from dataset import CENSUS_TRACT_2010_PATH, CENSUS_TRACT_PATH
+
+# Areal-interpolation crosswalk between census tract vintages. ACS releases before
+# 2020 are tabulated on 2010 tracts, later ones on 2020 tracts (the 2024 TIGER
+# file). The overlay of two vintages is computed once and stored as a sparse
+# target x source weight matrix, so reallocating a year is one sparse product.
+TRACT_PATHS = {
+    2010: CENSUS_TRACT_2010_PATH,
+    2024: CENSUS_TRACT_PATH,
+}
+TARGET_VINTAGE = 2024
+CROSSWALK_DIR = "../data/crosswalk"
+
+# Equal-area CRS for California, so intersection areas are comparable
+AREA_CRS = "EPSG:3310"
+# Overlaps below this share of the source tract are digitizing slivers
+MIN_WEIGHT = 1e-4
+
+# Counts are split by area share; 'area' itself is additive under area weights
+EXTENSIVE_COLUMNS = [
+    "num_pop", "num_pop_m", "num_pop_f", "num_pop_25_to_34", "num_pop_18", "num_pop_21", "num_pop_62",
+    "area",
+]
+# Stations are points, so their counts are never split: a source tract's counts
+# move whole to the target tract holding most of its area
+STATION_COLUMNS = [
+    "unique_station_count", "ev_level1_evse_num", "ev_level2_evse_num", "ev_dc_fast_num",
+    "time_acess", "nonpublic_acess",
+]
+# Averages are reallocated as population-weighted means
+INTENSIVE_COLUMNS = {"mu_income": "num_pop"}
+
+
+def vintage_for_year(year):
+    return 2010 if year < 2020 else 2024
+
+
+def _row_argmax(matrix):
+    import numpy as np
+
+    # Column of the largest entry in every row of a CSR matrix, without scipy's
+    # per-row Python loop (rows without entries get column 0)
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    order = np.lexsort((-matrix.data, rows))
+    present, first = np.unique(rows[order], return_index=True)
+    columns = np.zeros(matrix.shape[0], dtype=np.intp)
+    columns[present] = matrix.indices[order[first]]
+    return columns
+
+
+class Crosswalk:
+    """Sparse area weights from source tracts (columns) to target tracts (rows)."""
+
+    def __init__(self, source_geoids, target_geoids, weights):
+        import numpy as np
+
+        self.source_geoids = np.asarray(source_geoids)
+        self.target_geoids = np.asarray(target_geoids)
+        self.weights = weights.tocsr()
+        self._source_index = {g: i for i, g in enumerate(self.source_geoids)}
+
+    @classmethod
+    def build(cls, source_tracts, target_tracts, geoid_column="GEOID"):
+        # One STRtree query for all overlapping pairs, then vectorized intersections
+        import numpy as np
+        import shapely
+        from scipy import sparse
+
+        source = source_tracts.to_crs(AREA_CRS)
+        target = target_tracts.to_crs(AREA_CRS)
+        source_geoms = source.geometry.to_numpy()
+        target_geoms = target.geometry.to_numpy()
+
+        tree = shapely.STRtree(target_geoms)
+        source_idx, target_idx = tree.query(source_geoms, predicate="intersects")
+        overlap = shapely.area(shapely.intersection(source_geoms[source_idx], target_geoms[target_idx]))
+        share = overlap / shapely.area(source_geoms)[source_idx]
+
+        keep = share >= MIN_WEIGHT
+        weights = sparse.csr_matrix(
+            (share[keep], (target_idx[keep], source_idx[keep])),
+            shape=(len(target_geoms), len(source_geoms)),
+        )
+        # Shares of each source tract sum to 1, so reallocated totals are preserved
+        column_sums = np.asarray(weights.sum(axis=0)).ravel()
+        weights = weights @ sparse.diags(np.divide(1.0, column_sums, out=np.zeros_like(column_sums), where=column_sums > 0))
+        return cls(source[geoid_column].to_numpy(), target[geoid_column].to_numpy(), weights)
+
+    def save(self, path):
+        import numpy as np
+
+        np.savez(
+            path,
+            source_geoids=self.source_geoids.astype(str),
+            target_geoids=self.target_geoids.astype(str),
+            data=self.weights.data,
+            indices=self.weights.indices,
+            indptr=self.weights.indptr,
+            shape=self.weights.shape,
+        )
+
+    @classmethod
+    def load(cls, path):
+        import numpy as np
+        from scipy import sparse
+
+        with np.load(path) as f:
+            weights = sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            return cls(f["source_geoids"], f["target_geoids"], weights)
+
+    def reallocate(self, rows):
+        # rows: one year of tract rows on the source vintage, with a 'GeoID' column.
+        # Returns the same columns on the target tracts (plus 'GeoID')
+        import numpy as np
+        import pandas as pd
+
+        positions = rows["GeoID"].map(self._source_index)
+        matched = positions.notna().to_numpy()
+        positions = positions[matched].to_numpy(dtype=np.intp)
+        rows = rows[matched]
+        weights = self.weights[:, positions]
+
+        result = pd.DataFrame({"GeoID": self.target_geoids})
+        extensive = [c for c in EXTENSIVE_COLUMNS if c in rows.columns]
+        if extensive:
+            values = rows[extensive].to_numpy(dtype=float)
+            known = ~np.isnan(values)
+            # One sparse product for all count columns; targets no known source
+            # value reaches stay missing instead of becoming 0
+            totals = weights @ np.where(known, values, 0.0)
+            coverage = weights @ known.astype(float)
+            result[extensive] = np.where(coverage > 0, totals, np.nan)
+        stations = [c for c in STATION_COLUMNS if c in rows.columns]
+        if stations:
+            values = rows[stations].to_numpy(dtype=float)
+            known = ~np.isnan(values)
+            by_source = weights.T.tocsr()
+            placed = np.diff(by_source.indptr) > 0
+            target = _row_argmax(by_source)[placed]
+            totals = np.zeros((len(self.target_geoids), len(stations)))
+            np.add.at(totals, target, np.where(known, values, 0.0)[placed])
+            # Targets overlapping a known source without being its main target get 0
+            coverage = weights @ known.astype(float)
+            result[stations] = np.where(coverage > 0, totals, np.nan)
+        for column, weight_column in INTENSIVE_COLUMNS.items():
+            if column not in rows.columns or weight_column not in rows.columns:
+                continue
+            values = pd.to_numeric(rows[column], errors="coerce").to_numpy(dtype=float)
+            population = rows[weight_column].to_numpy(dtype=float)
+            known = ~np.isnan(values) & ~np.isnan(population)
+            numerator = weights @ np.where(known, values * population, 0.0)
+            denominator = weights @ np.where(known, population, 0.0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                result[column] = np.where(denominator > 0, numerator / denominator, np.nan)
+
+        # Everything else (e.g. 'city') comes from the source tract contributing the most area
+        reached = np.asarray(weights.sum(axis=1)).ravel() > 0
+        dominant = _row_argmax(weights)
+        for column in rows.columns:
+            if column not in result.columns:
+                result[column] = rows[column].to_numpy()[dominant]
+        result = result[reached]
+        return result.reset_index(drop=True)
+
+
+def _crosswalk_path(source_vintage, target_vintage):
+    return os.path.join(CROSSWALK_DIR, f"tracts_{source_vintage}_to_{target_vintage}.npz")
+
+
+def build_crosswalk(source_vintage, target_vintage):
+    import geopandas as gpd
+
+    source = gpd.read_file(TRACT_PATHS[source_vintage], columns=["GEOID"])
+    target = gpd.read_file(TRACT_PATHS[target_vintage], columns=["GEOID"])
+    return Crosswalk.build(source, target)
+
+
+_crosswalks = {}
+_crosswalks_lock = threading.Lock()
+
+
+def crosswalk_for(source_vintage, target_vintage=TARGET_VINTAGE):
+    # Cached in memory and on disk per vintage pair; rebuilt when a shapefile is newer
+    key = (source_vintage, target_vintage)
+    with _crosswalks_lock:
+        if key not in _crosswalks:
+            path = _crosswalk_path(*key)
+            sources = [TRACT_PATHS[source_vintage], TRACT_PATHS[target_vintage]]
+            if os.path.exists(path) and all(os.path.getmtime(path) >= os.path.getmtime(s) for s in sources):
+                _crosswalks[key] = Crosswalk.load(path)
+            else:
+                crosswalk = build_crosswalk(source_vintage, target_vintage)
+                os.makedirs(CROSSWALK_DIR, exist_ok=True)
+                tmp_path = f"{path}.tmp.npz"
+                crosswalk.save(tmp_path)
+                os.replace(tmp_path, path)
+                _crosswalks[key] = crosswalk
+        return _crosswalks[key]
+
+
+def harmonize_years(gdf, target_vintage=TARGET_VINTAGE):
+    # Move every year tabulated on an older tract vintage onto the target tracts.
+    # Vintages whose shapefile is missing are left as they are
+    import pandas as pd
+
+    frames = []
+    for year, rows in gdf.groupby("year", sort=True, dropna=False):
+        vintage = target_vintage if pd.isna(year) else vintage_for_year(int(float(year)))
+        if vintage == target_vintage or not os.path.exists(TRACT_PATHS[vintage]):
+            frames.append(rows)
+            continue
+        reallocated = crosswalk_for(vintage, target_vintage).reallocate(rows.drop(columns="year"))
+        reallocated.insert(1, "year", year)
+        frames.append(reallocated[rows.columns])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,310 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+# Input and output locations (relative to the shiny-app directory)
+DATA_PATH = "../data/ev_final_demo_merged.geojson"
+CENSUS_TRACT_PATH = "/Volumes/Nancy/data/tl_2024_06_tract/tl_2024_06_tract.shp"
+# 2010 tracts, for reallocating pre-2020 ACS years onto the 2024 tracts
+CENSUS_TRACT_2010_PATH = os.environ.get("EV_APP_TRACTS_2010", "../data/tracts/tl_2019_06_tract/tl_2019_06_tract.shp")
+METADATA_PATH = os.environ.get("EV_APP_METADATA_PATH", "../data/app_metadata.json")
+
+logger = logging.getLogger(__name__)
+
+# Accessibility percentile mode: "pooled" (all years together) or "per_year"
+ACCESSIBILITY_BIN_MODE = os.environ.get("EV_APP_ACCESSIBILITY_BINS", "pooled")
+
+
+# Data Preparation
+def prepare_data():
+    # Heavy libraries are imported here so that importing this module stays cheap
+    import geopandas as gpd
+    import pandas as pd
+    import numpy as np
+    from accessibility_binning import AccessibilityBinner
+    from crosswalk import harmonize_years
+
+    # Load the GeoDataFrame
+    gdf = gpd.read_file(DATA_PATH)
+
+    # Drop rows where 'num_pop' is NaN and where 'num_pop' is 0
+    gdf = gdf.dropna(subset=['num_pop'])
+    gdf = gdf[gdf['num_pop'] > 0]
+
+    # Ensure all values in 'groups_with_access_code' are lowercase
+    gdf['groups_with_access_code'] = gdf['groups_with_access_code'].str.lower()
+
+    # Assign 'time_acess' = 1 if 'groups_with_access_code' contains '24 hours'
+    gdf['time_acess'] = gdf['groups_with_access_code'].apply(lambda x: 1 if '24 hours' in x else 0)
+
+    # Assign 'nonpublic_acess' = 1 if 'groups_with_access_code' contains 'required' or 'only'
+    gdf['nonpublic_acess'] = gdf['groups_with_access_code'].apply(lambda x: 1 if 'required' in x or 'only' in x else 0)
+
+    # Path to the full census tract shapefile
+    # Load the shapefile
+    tracts = gpd.read_file(CENSUS_TRACT_PATH)
+
+    # Filter for LA County using the FIPS code ('037' for Los Angeles)
+    la_tracts = tracts[tracts['COUNTYFP'] == '037']
+
+    # Group by 'GeoID' and 'year', apply specific aggregation rules
+    gdf = (
+        gdf.groupby(['GeoID', 'year'])
+        .agg(
+            unique_station_count=('station_name', 'nunique'),
+            num_pop=('num_pop', 'first'),
+            num_pop_m=('num_pop_m', 'first'),
+            num_pop_f=('num_pop_f', 'first'),
+            num_pop_25_to_34=('num_pop_25_to_34', 'first'),
+            num_pop_18=('num_pop_18', 'first'),
+            num_pop_21=('num_pop_21', 'first'),
+            num_pop_62=('num_pop_62', 'first'),
+            mu_income=('mu_income', 'first'),
+            geometry=('geometry', lambda x: list(x.unique())),  # Collect all unique geometry values as a list
+            area=('area', 'first'),
+            city=('city', lambda x: list(x.unique()) if x.nunique() > 1 else x.iloc[0]),
+            ev_level1_evse_num=('ev_level1_evse_num', 'sum'),
+            ev_level2_evse_num=('ev_level2_evse_num', 'sum'),
+            ev_dc_fast_num=('ev_dc_fast_num', 'sum'),
+            time_acess=('time_acess', 'sum'),
+            nonpublic_acess=('nonpublic_acess', 'sum'),
+        )
+        .reset_index()
+    )
+
+    # Drop unnecessary columns directly in the grouped DataFrame
+    columns_to_drop_group = ['zip', 'groups_with_access_code', 'access_days_time', 'status_code', 'street_address','geometry']
+    gdf = gdf.drop(columns=columns_to_drop_group, errors='ignore')
+
+    numeric_columns = ['ev_level1_evse_num','ev_level2_evse_num', 'ev_dc_fast_num', 
+                   'time_acess','nonpublic_acess',
+                   'unique_station_count']
+    gdf[numeric_columns] = gdf[numeric_columns].fillna(0)
+
+    # Years tabulated on 2010 tracts are reallocated onto the 2024 tracts through
+    # the cached areal-interpolation crosswalk, so every year joins by GeoID below
+    gdf = harmonize_years(gdf)
+
+    # Calculate 'accessibility', handle cases where 'num_pop' is 0 or NA
+    gdf['accessibility'] = gdf.apply(
+        lambda row: (row['unique_station_count'] / row['num_pop']) * 1000 
+        if pd.notna(row['num_pop']) and row['num_pop'] != 0 else np.nan,
+        axis=1
+    )
+
+    # Percentile bins, 'Depopulated Zone' for NA values. "pooled" ranks all years
+    # together (identical to pd.qcut), "per_year" ranks each year against its own
+    # distribution. Edges are exact at this data size; per-(year, county) quantile
+    # sketches are only built above EXACT_MAX_ROWS
+    binner = AccessibilityBinner()
+    gdf['accessibility_bins'] = binner.assign_bins(gdf, mode=ACCESSIBILITY_BIN_MODE)
+
+    # Convert 'mu_income' to numeric
+    gdf['mu_income'] = pd.to_numeric(gdf['mu_income'], errors='coerce')
+
+    # Create a mask for NA values in 'mu_income'
+    na_mask_income = gdf['mu_income'].isna()
+
+    # Define bins for 'mu_income'
+    num_bins_income = 5
+    income_bins = pd.cut(
+        gdf.loc[~na_mask_income, 'mu_income'],  # Only consider non-NA values
+        bins=num_bins_income,
+        precision=2
+    )
+
+    # Extract range categories for non-NA values
+    bin_ranges = income_bins.cat.categories
+
+    # Map bin ranges to descriptive labels
+    bin_labels = ["Low", "Middle Low", "Middle", "Middle High", "High"]
+    bin_mapping = {i: label for i, label in enumerate(bin_labels)}
+
+    # Assign bin indices for non-NA values
+    gdf.loc[~na_mask_income, 'mu_income_bins'] = pd.cut(
+        gdf.loc[~na_mask_income, 'mu_income'], 
+        bins=num_bins_income, 
+        precision=2, 
+        labels=range(num_bins_income)
+    ).astype(float)
+
+    # Assign bin range and label for non-NA values
+    gdf.loc[~na_mask_income, 'mu_income_bins_range'] = pd.cut(
+        gdf.loc[~na_mask_income, 'mu_income'], 
+        bins=num_bins_income, 
+        precision=2
+    ).astype(str)
+
+    gdf.loc[~na_mask_income, 'mu_income_bins_label'] = pd.cut(
+        gdf.loc[~na_mask_income, 'mu_income'], 
+        bins=num_bins_income, 
+        precision=2, 
+        labels=bin_labels
+    ).astype(str)
+
+    # Assign 'Depopulated Zone' to NA values
+    gdf.loc[na_mask_income, 'mu_income_bins'] = np.nan
+    gdf.loc[na_mask_income, 'mu_income_bins_range'] = 'Depopulated Zone'
+    gdf.loc[na_mask_income, 'mu_income_bins_label'] = 'Depopulated Zone'
+
+    # Convert 'mu_income_bins_label' to categorical type with specified order
+    gdf['mu_income_bins_label'] = pd.Categorical(
+        gdf['mu_income_bins_label'], 
+        categories=bin_labels + ['Depopulated Zone'], 
+        ordered=True
+    )
+
+    # Optionally convert ranges and labels to string for export
+    gdf['mu_income_bins_range'] = gdf['mu_income_bins_range'].astype(str)
+    gdf['mu_income_bins_label'] = gdf['mu_income_bins_label'].astype(str)
+
+
+    # Aggregate data by year and bins
+    income_bins_data = gdf.groupby(['year', 'mu_income_bins_label']).size().reset_index(name='count')
+
+    # Filter the data to include only the years 2022, 2023, and 2024
+    filtered_data = income_bins_data[income_bins_data['year'].isin([2022, 2023, 2024])]
+
+    # Merge gdf data onto LA County tracts (keep all LA tracts)
+    merged_gdf = la_tracts.merge(gdf, left_on='GEOID', right_on='GeoID', how='left')
+
+    # Merge gdf data onto LA County tracts (keep all LA tracts)
+    merged_gdf = la_tracts.merge(gdf, left_on='GEOID', right_on='GeoID', how='outer')
+
+    merged_gdf = merged_gdf.set_geometry('geometry')
+    merged_gdf["year"] = merged_gdf["year"].astype("Int64").dropna() 
+    
+    return merged_gdf
+
+
+def load_dataset():
+    merged_gdf = prepare_data()
+
+    # Clean and validate the 'year' column
+    merged_gdf = merged_gdf[merged_gdf["year"].notna()]  # Drop rows with NaN in 'year'
+    merged_gdf["year"] = merged_gdf["year"].astype(int)  # Convert 'year' to integers
+    return merged_gdf
+
+
+# Extract unique cities for the dropdown
+def extract_unique_cities(city_column):
+    unique_cities = set()  # Use a set to avoid duplicates
+    for value in city_column.dropna():  # Drop NA values
+        if isinstance(value, list):  # If the value is a list
+            unique_cities.update(value)  # Add all cities in the list to the set
+        else:  # If it's a single city (not a list)
+            unique_cities.add(value)
+    return sorted(unique_cities)  # Return sorted list of unique cities
+
+
+# UI metadata: the dropdown choices, small enough to read before the dataset loads
+def build_metadata(merged_gdf):
+    return {
+        "year_choices": [str(year) for year in sorted(merged_gdf["year"].unique())],
+        "city_choices": ["All"] + extract_unique_cities(merged_gdf["city"]),
+    }
+
+
+def read_metadata(path=METADATA_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_metadata(metadata, path=METADATA_PATH):
+    # Write to a temporary file first so a concurrent reader never sees a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def dataset_version(paths=(DATA_PATH, CENSUS_TRACT_PATH, CENSUS_TRACT_2010_PATH)):
+    # Identifies every input a load is built from (data file, both tract vintages,
+    # binning mode), so the same inputs give the same version in every worker and
+    # across restarts
+    digest = hashlib.sha1(ACCESSIBILITY_BIN_MODE.encode())
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+class DatasetLoader:
+    """Loads the prepared dataset once, either inline or on a background thread."""
+
+    def __init__(self, load=load_dataset, metadata_path=METADATA_PATH):
+        self._load = load
+        self._metadata_path = metadata_path
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.data = None
+        self.error = None
+        self.started_at = None
+        self.load_seconds = None
+        self.version = None
+
+    def start(self):
+        # Kick off loading in a daemon thread; safe to call more than once
+        with self._lock:
+            if self._thread is None and not self._ready.is_set():
+                self._thread = threading.Thread(target=self.load, name="dataset-loader", daemon=True)
+                self._thread.start()
+        return self
+
+    def load(self):
+        self.started_at = time.perf_counter()
+        self.version = dataset_version()
+        try:
+            self.data = self._load()
+        except Exception as e:  # surfaced through status() and get()
+            self.error = e
+        else:
+            # A published (shared) dataset carries the version of what was loaded
+            self.version = getattr(self.data, "attrs", {}).get("version") or self.version
+            self.refresh_metadata()
+        finally:
+            self.load_seconds = time.perf_counter() - self.started_at
+            self._ready.set()
+        return self.data
+
+    def refresh_metadata(self):
+        # Rewrite the metadata file so the next boot can skip the synchronous load.
+        # Only an optimization: a read-only or missing data directory must not turn
+        # a loaded dataset into an error
+        try:
+            metadata = build_metadata(self.data)
+            if metadata != read_metadata(self._metadata_path):
+                write_metadata(metadata, self._metadata_path)
+        except Exception:
+            logger.warning("Could not write %s", self._metadata_path, exc_info=True)
+
+    def is_ready(self):
+        return self._ready.is_set() and self.error is None
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def get(self):
+        # Block until the dataset is available (or loading failed)
+        self._ready.wait()
+        if self.error is not None:
+            raise RuntimeError("Dataset failed to load") from self.error
+        return self.data
+
+    def status(self):
+        if not self._ready.is_set():
+            return "loading"
+        return "error" if self.error is not None else "ready"
+
+
+if __name__ == "__main__":
+    # Precompute the dropdown metadata (python dataset.py), so even the first boot
+    # binds its port before the dataset is loaded
+    write_metadata(build_metadata(load_dataset()))
@@ -0,0 +1,344 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+from benchmark import free_port, healthz, report, synthetic_tracts, wait_for_port
+
+# Load test: start the app locally and drive N concurrent Shiny sessions over the
+# websocket protocol. Each session changes the page 1 and 2 inputs on a
+# think-time schedule. The test reports latency percentiles per output and the
+# worker's CPU and RSS. Maps are drawn without basemap tiles, so it runs offline.
+# Seeds are fixed, so runs with the same arguments are comparable across commits.
+# Run from the shiny-app directory:
+#   python loadtest.py --sessions 20 --actions 10
+#   python loadtest.py --synthetic --sessions 50 --json loadtest.json
+#   python loadtest.py --url http://127.0.0.1:8000 --pid 12345   (an already running app)
+
+INCOME_BINS = ["Low", "Middle Low", "Middle", "Middle High", "High"]
+# Outputs on pages 1 and 2, the ones the simulated inputs drive
+OUTPUTS = [
+    "income_range", "accessibility_range", "unique_geoids", "map_plot", "accessibility_map_plot",
+    "income_range_city", "accessibility_range_city", "unique_geoids_city", "city_income_map", "city_accessibility_map",
+]
+# Relative frequency of each input change in a session
+INPUT_WEIGHTS = {"year": 3, "income_bins": 2, "city": 3, "year_page2": 2}
+PERCENTILES = [50, 95, 99]
+
+
+def synthetic_dataset(side=50, years=8, seed=0):
+    import pandas as pd
+    from accessibility_binning import AccessibilityBinner
+
+    # benchmark.py's grid tracts (about LA County's tract count at side=50), with
+    # the remaining columns the pages draw
+    gdf = synthetic_tracts(side=side, years=years, seed=seed)
+    rng = np.random.default_rng(seed)
+    tracts = side * side
+    cities = np.array(["Los Angeles", "Long Beach", "Pasadena", "Glendale", "Santa Monica"], dtype=object)
+    tract_city = list(cities[rng.integers(0, len(cities), tracts)])
+    # A few tracts span two cities, as in the real data
+    for i in rng.choice(tracts, tracts // 20, replace=False):
+        if tract_city[i] != "Los Angeles":
+            tract_city[i] = ["Los Angeles", tract_city[i]]
+    gdf["city"] = tract_city * years
+    gdf["year"] = gdf["year"].astype(int)
+    gdf["mu_income"] = np.tile(rng.lognormal(11.2, 0.5, tracts), years) * rng.uniform(0.95, 1.1, len(gdf))
+    # Tracts in the prepared data come from station records, so each has at least one
+    gdf["unique_station_count"] = rng.poisson(1.5, len(gdf)) + 1
+    gdf["ev_level1_evse_num"] = rng.poisson(0.1, len(gdf))
+    gdf["ev_level2_evse_num"] = gdf["unique_station_count"] * 2
+    gdf["ev_dc_fast_num"] = rng.poisson(0.2, len(gdf))
+    gdf["accessibility"] = gdf["unique_station_count"] / gdf["num_pop"] * 1000
+
+    # Same binning as prepare_data()
+    gdf["accessibility_bins"] = AccessibilityBinner().assign_bins(gdf)
+    gdf["mu_income_bins_range"] = pd.cut(gdf["mu_income"], bins=5, precision=2).astype(str)
+    gdf["mu_income_bins_label"] = pd.cut(gdf["mu_income"], bins=5, precision=2, labels=INCOME_BINS).astype(str)
+    return gdf
+
+
+def client_data():
+    # What the browser reports about itself and each output; all outputs visible
+    data = {
+        ".clientdata_pixelratio": 1,
+        ".clientdata_url_protocol": "http:",
+        ".clientdata_url_hostname": "127.0.0.1",
+        ".clientdata_url_port": "",
+        ".clientdata_url_pathname": "/",
+        ".clientdata_url_search": "",
+        ".clientdata_url_hash_initial": "",
+        ".clientdata_url_hash": "",
+        ".clientdata_singletons": "",
+    }
+    for output in OUTPUTS:
+        data[f".clientdata_output_{output}_width"] = 800
+        data[f".clientdata_output_{output}_height"] = 600
+        data[f".clientdata_output_{output}_hidden"] = False
+    return data
+
+
+def next_change(rng, inputs, choices):
+    # Pick an input by weight and a value different from the current one
+    name = rng.choices(list(INPUT_WEIGHTS), weights=list(INPUT_WEIGHTS.values()))[0]
+    if name == "income_bins":
+        while True:
+            value = sorted(rng.sample(INCOME_BINS, rng.randint(1, len(INCOME_BINS))), key=INCOME_BINS.index)
+            if value != inputs[name]:
+                return name, value
+    options = choices["city_choices"] if name == "city" else choices["year_choices"]
+    others = [o for o in options if o != inputs[name]] or options
+    return name, rng.choice(others)
+
+
+class Results:
+    """Latency samples per output and per input change, plus error counts."""
+
+    def __init__(self):
+        self.outputs = {}
+        self.actions = {}
+        self.errors = 0
+        self.timeouts = 0
+
+    def record(self, group, name, seconds):
+        group.setdefault(name, []).append(seconds * 1000)
+
+    def summary(self):
+        def percentiles(samples):
+            values = np.percentile(samples, PERCENTILES)
+            return {"count": len(samples), **{f"p{p}": float(v) for p, v in zip(PERCENTILES, values)}}
+
+        return {
+            "outputs": {name: percentiles(s) for name, s in sorted(self.outputs.items())},
+            "actions": {name: percentiles(s) for name, s in sorted(self.actions.items())},
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+        }
+
+
+async def collect(ws, started, results, action, timeout):
+    # Shiny reports each output as "recalculated" once it has rendered, then goes
+    # idle and sends all new values in one flush. Output latency is the former;
+    # the action is complete when that flush arrives
+    deadline = started + timeout
+    idle = False
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            results.timeouts += 1
+            return
+        try:
+            message = json.loads(await asyncio.wait_for(ws.recv(), remaining))
+        except asyncio.TimeoutError:
+            results.timeouts += 1
+            return
+        now = time.perf_counter()
+        status = message.get("recalculating", {})
+        if status.get("status") == "recalculated":
+            results.record(results.outputs, status["name"], now - started)
+        # Only real exceptions are sent as errors; req() failures are silent
+        results.errors += len(message.get("errors") or {})
+        if message.get("busy") == "idle":
+            idle = True
+        if idle and "values" in message:
+            results.record(results.actions, action, now - started)
+            return
+
+
+async def run_session(ws_url, inputs, choices, actions, think_time, delay, seed, results, timeout):
+    import websockets
+
+    rng = random.Random(seed)
+    inputs = dict(inputs)
+    await asyncio.sleep(delay)
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        started = time.perf_counter()
+        await ws.send(json.dumps({"method": "init", "data": {**inputs, **client_data()}}))
+        await collect(ws, started, results, "init", timeout)
+        for _ in range(actions):
+            await asyncio.sleep(rng.expovariate(1 / think_time))
+            name, value = next_change(rng, inputs, choices)
+            inputs[name] = value
+            started = time.perf_counter()
+            await ws.send(json.dumps({"method": "update", "data": {name: value}}))
+            await collect(ws, started, results, name, timeout)
+
+
+class ProcessSampler:
+    """CPU share and RSS of one process, sampled from /proc (Linux)."""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.cpu = []
+        self.rss = []
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime and stime, fields 14 and 15 of /proc/<pid>/stat
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss_mb(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return float("nan")
+
+    async def run(self, stop):
+        last_cpu, last_time = self.cpu_seconds(), time.perf_counter()
+        while not stop.is_set():
+            await asyncio.sleep(self.interval)
+            cpu, now = self.cpu_seconds(), time.perf_counter()
+            self.cpu.append((cpu - last_cpu) / (now - last_time) * 100)
+            self.rss.append(self.rss_mb())
+            last_cpu, last_time = cpu, now
+
+    def summary(self):
+        if not self.cpu:
+            return {}
+        return {
+            "cpu_mean_pct": float(np.mean(self.cpu)),
+            "cpu_max_pct": float(np.max(self.cpu)),
+            "rss_start_mb": self.rss[0],
+            "rss_max_mb": float(np.max(self.rss)),
+            "rss_end_mb": self.rss[-1],
+        }
+
+
+async def run_load(base_url, pid, args):
+    with urllib.request.urlopen(f"{base_url}/api/metadata", timeout=30) as resp:
+        choices = json.load(resp)
+    initial = {
+        "year": choices["year_choices"][-1],
+        "income_bins": INCOME_BINS,
+        "city": "All",
+        "year_page2": choices["year_choices"][-1],
+    }
+    ws_url = base_url.replace("http", "ws", 1) + "/websocket/"
+
+    results = Results()
+    sampler = ProcessSampler(pid) if pid else None
+    stop = asyncio.Event()
+    sampling = asyncio.create_task(sampler.run(stop)) if sampler else None
+    started = time.perf_counter()
+    # Sessions arrive evenly over the ramp-up period
+    await asyncio.gather(*[
+        run_session(ws_url, initial, choices, args.actions, args.think_time,
+                    args.ramp_up * i / args.sessions, args.seed + i, results, args.timeout)
+        for i in range(args.sessions)
+    ])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    if sampling:
+        await sampling
+
+    summary = results.summary()
+    summary["elapsed_s"] = elapsed
+    summary["process"] = sampler.summary() if sampler else {}
+    return summary
+
+
+def start_app(port, env, log):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    if not wait_for_port(port, timeout=120):
+        process.kill()
+        raise SystemExit("The app did not start; see the log above")
+    # Wait until the dataset is loaded, so the sessions measure steady-state work
+    while (status := healthz(port)["status"]) == "loading":
+        time.sleep(0.1)
+    if status != "ready":
+        process.kill()
+        raise SystemExit(f"The app failed to load its dataset ({status})")
+    return process
+
+
+def print_summary(summary):
+    for group in ("outputs", "actions"):
+        for name, stats in summary[group].items():
+            for p in PERCENTILES:
+                report(f"loadtest.{group[:-1]}.{name}.p{p}", stats[f"p{p}"], "ms")
+    report("loadtest.errors", summary["errors"])
+    report("loadtest.timeouts", summary["timeouts"])
+    report("loadtest.elapsed", summary["elapsed_s"])
+    for name, value in summary["process"].items():
+        unit = "%" if name.endswith("_pct") else "MB"
+        report(f"loadtest.process.{name.rsplit('_', 1)[0]}", value, unit)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive concurrent Shiny sessions against the app.")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent sessions")
+    parser.add_argument("--actions", type=int, default=10, help="input changes per session")
+    parser.add_argument("--think-time", type=float, default=2.0, help="mean seconds between a session's changes")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="seconds over which sessions connect")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for one update")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--synthetic", action="store_true", help="serve a synthetic dataset instead of ../data")
+    parser.add_argument("--url", help="test an already running app instead of starting one")
+    parser.add_argument("--pid", type=int, help="process to sample CPU/RSS from when using --url")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        process = None
+        if args.url:
+            base_url, pid = args.url.rstrip("/"), args.pid
+        else:
+            env = {**os.environ, "EV_APP_BASEMAP": "0"}
+            if args.synthetic:
+                from shared_dataset import publish
+
+                # Served through the shared-dataset path. The simulated pages 1 and 2
+                # read nothing else, and the files other pages would write (metadata,
+                # catalog Parquet) go to the temporary directory instead of ../data
+                shared_path = os.path.join(tmp, "merged_gdf.arrow")
+                publish(synthetic_dataset(seed=args.seed), shared_path)
+                env.update({
+                    "EV_APP_SHARED_DATASET": "1",
+                    "EV_APP_SHARED_PATH": shared_path,
+                    "EV_APP_METADATA_PATH": os.path.join(tmp, "app_metadata.json"),
+                    "EV_APP_PARQUET_DIR": os.path.join(tmp, "parquet"),
+                })
+            port = free_port()
+            log_path = os.path.join(tmp, "app.log")
+            with open(log_path, "wb") as log:
+                try:
+                    process = start_app(port, env, log)
+                except SystemExit:
+                    with open(log_path) as f:
+                        sys.stderr.write(f.read()[-4000:])
+                    raise
+            base_url, pid = f"http://127.0.0.1:{port}", process.pid
+
+        try:
+            summary = asyncio.run(run_load(base_url, pid, args))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    summary["parameters"] = {k: v for k, v in vars(args).items() if k not in ("json", "url", "pid")}
+    # Which tree the numbers belong to, for comparisons across commits
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    summary["commit"] = commit.stdout.strip() or None
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
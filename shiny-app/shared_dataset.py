@@ -0,0 +1,119 @@
+import fcntl
+import hashlib
+import os
+
+from dataset import DATA_PATH, dataset_version, load_dataset
+
+# Shared copy of the prepared dataset, published once and memory-mapped by every
+# uvicorn worker. Enable with EV_APP_SHARED_DATASET=1.
+SHARED_PATH = os.environ.get("EV_APP_SHARED_PATH", "../data/shared/merged_gdf.arrow")
+
+GEOMETRY_COLUMN = "geometry_wkb"
+
+
+def to_arrow_table(merged_gdf, version=None):
+    import pyarrow as pa
+
+    # Attribute columns as plain Arrow columns; 'city' mixes strings and lists,
+    # so it is normalized to a list column here and restored in open_shared()
+    attributes = merged_gdf.drop(columns=[merged_gdf.geometry.name, "city"])
+    table = pa.Table.from_pandas(attributes, preserve_index=False)
+    cities = [[c] if isinstance(c, str) else c for c in merged_gdf["city"]]
+    table = table.append_column("city", pa.array(cities, type=pa.list_(pa.string())))
+
+    # Geometry as WKB so it can be mapped without building GEOS objects
+    table = table.append_column(GEOMETRY_COLUMN, pa.array(merged_gdf.geometry.to_wkb(), type=pa.binary()))
+    crs = merged_gdf.crs.to_json() if merged_gdf.crs is not None else ""
+    # The version of the inputs the table was built from, checked by is_stale()
+    version = dataset_version() if version is None else version
+    return table.replace_schema_metadata({"crs": crs, "version": version})
+
+
+def publish(merged_gdf, path=SHARED_PATH, version=None):
+    import pyarrow as pa
+
+    table = to_arrow_table(merged_gdf, version)
+
+    # Uncompressed IPC file so readers can map the buffers in place; written to a
+    # temporary file first so workers never map a partial file
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def open_shared(path=SHARED_PATH):
+    import pandas as pd
+    import pyarrow as pa
+
+    # Reading from a memory map is zero-copy: the DataFrame columns below are backed
+    # by the page cache, so every worker shares one physical copy
+    source = pa.memory_map(path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    df = table.drop_columns(["city"]).to_pandas(types_mapper=pd.ArrowDtype)
+
+    # The app expects a single city as a string and several as a list; this small
+    # column is the only one rebuilt per worker
+    df["city"] = pd.Series(
+        [c[0] if c is not None and len(c) == 1 else c for c in table.column("city").to_pylist()],
+        index=df.index,
+        dtype=object,
+    )
+    df.attrs["crs"] = table.schema.metadata.get(b"crs", b"").decode() or None
+    # Version of the data actually served: the inputs it was built from plus this
+    # file, so a republished file (e.g. a new synthetic dataset) changes it too
+    stat = os.stat(path)
+    identity = f"{table.schema.metadata.get(b'version', b'').decode()}:{stat.st_size}:{stat.st_mtime_ns}"
+    df.attrs["version"] = hashlib.sha1(identity.encode()).hexdigest()[:16]
+    return df
+
+
+def as_geodataframe(df):
+    # Decode WKB only for the rows that are about to be drawn
+    import geopandas as gpd
+
+    if isinstance(df, gpd.GeoDataFrame):
+        return df
+    geometry = gpd.GeoSeries.from_wkb(df[GEOMETRY_COLUMN].to_numpy(), index=df.index, crs=df.attrs.get("crs"))
+    return gpd.GeoDataFrame(df.drop(columns=[GEOMETRY_COLUMN]), geometry=geometry)
+
+
+def published_version(path=SHARED_PATH):
+    # Only the schema is read, not the data (Arrow IPC, or Parquet from the catalog)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if path.endswith(".parquet"):
+        metadata = pq.read_schema(path).metadata or {}
+    else:
+        with pa.memory_map(path, "r") as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return metadata.get(b"version", b"").decode() or None
+
+
+def is_stale(path=SHARED_PATH, version=None):
+    # Stale when the file was published from other inputs (data file, tract
+    # shapefiles, binning mode) or, if given, from another dataset version.
+    # Without the source data file there is nothing to rebuild the inputs from
+    if not os.path.exists(path):
+        return True
+    if version is None:
+        if not os.path.exists(DATA_PATH):
+            return False
+        version = dataset_version()
+    return published_version(path) != version
+
+
+def load_shared(path=SHARED_PATH, load=load_dataset):
+    # The first worker to take the lock prepares and publishes the dataset; the
+    # others block on the lock and then just map the published file
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if is_stale(path):
+                publish(load(), path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return open_shared(path)
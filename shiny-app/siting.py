@@ -0,0 +1,145 @@
+import heapq
+import threading
+
+from crosswalk import AREA_CRS
+from shared_dataset import as_geodataframe
+
+# Charger siting: choose K candidate tract centroids that maximize the (optionally
+# income-weighted) population newly within reach of a charger. Greedy selection
+# with a lazy priority queue over a sparse candidate x tract coverage matrix.
+# Distances are measured in California Albers (metres on the ground); Web
+# Mercator would stretch them by ~1.2x at LA's latitude. Results come back in
+# that CRS and are reprojected only for drawing.
+
+LOW_INCOME_LABELS = ["Low", "Middle Low"]
+
+
+def coverage_matrix(candidate_points, demand_points, radius):
+    # Entry (i, j) is set when candidate i is within 'radius' of demand point j
+    import numpy as np
+    from scipy import sparse
+    from shapely import STRtree
+
+    tree = STRtree(demand_points)
+    candidate_idx, demand_idx = tree.query(candidate_points, predicate="dwithin", distance=radius)
+    return sparse.csr_matrix(
+        (np.ones(len(candidate_idx), dtype=np.int8), (candidate_idx, demand_idx)),
+        shape=(len(candidate_points), len(demand_points)),
+    )
+
+
+def lazy_greedy(coverage, weights, k, covered=None):
+    import numpy as np
+
+    # Coverage gains only shrink as sites are added (submodularity), so a stale gain
+    # in the heap is an upper bound: a candidate whose refreshed gain still beats
+    # the next stale bound is the true best and is selected without rescoring the rest
+    covered = np.zeros(coverage.shape[1], dtype=bool) if covered is None else covered.copy()
+    indptr, indices = coverage.indptr, coverage.indices
+
+    def gain(i):
+        cols = indices[indptr[i]:indptr[i + 1]]
+        return weights[cols][~covered[cols]].sum()
+
+    initial = coverage @ np.where(covered, 0.0, weights)
+    heap = [(-g, i) for i, g in enumerate(initial) if g > 0]
+    heapq.heapify(heap)
+
+    selected, gains = [], []
+    while heap and len(selected) < k:
+        _, i = heapq.heappop(heap)
+        g = gain(i)
+        if heap and g < -heap[0][0]:
+            heapq.heappush(heap, (-g, i))
+            continue
+        if g <= 0:
+            break
+        selected.append(i)
+        gains.append(g)
+        covered[indices[indptr[i]:indptr[i + 1]]] = True
+    return selected, gains, covered
+
+
+class SitingModel:
+    """Per-year tract centroids and cached coverage matrices for the siting optimizer."""
+
+    def __init__(self, merged_gdf):
+        self.merged_gdf = merged_gdf
+        self._tracts = {}
+        self._coverage = {}
+        self._lock = threading.Lock()
+
+    def tracts(self, year):
+        with self._lock:
+            if year not in self._tracts:
+                rows = self.merged_gdf[self.merged_gdf["year"] == year].drop_duplicates("GeoID")
+                tracts = as_geodataframe(rows).to_crs(AREA_CRS).reset_index(drop=True)
+                tracts["centroid"] = tracts.geometry.centroid
+                self._tracts[year] = tracts
+            return self._tracts[year]
+
+    def coverage(self, year, radius):
+        tracts = self.tracts(year)
+        with self._lock:
+            if (year, radius) not in self._coverage:
+                points = tracts["centroid"].to_numpy()
+                self._coverage[(year, radius)] = coverage_matrix(points, points, radius)
+            return self._coverage[(year, radius)]
+
+    def propose(self, year, k, radius=2000, equity_weight=0.0):
+        import geopandas as gpd
+        import numpy as np
+
+        tracts = self.tracts(year)
+        coverage = self.coverage(year, radius)
+        population = tracts["num_pop"].fillna(0).to_numpy(dtype=float)
+
+        # Optional extra weight for people in the lower income groups
+        low_income = tracts["mu_income_bins_label"].isin(LOW_INCOME_LABELS).to_numpy(dtype=bool)
+        weights = population * np.where(low_income, 1 + equity_weight, 1)
+
+        # Tracts that already have a station count as sites that are already built
+        existing = tracts["unique_station_count"].fillna(0).to_numpy() > 0
+        covered_before = np.asarray(coverage[existing].sum(axis=0)).ravel() > 0
+
+        selected, gains, covered_after = lazy_greedy(coverage, weights, k, covered_before)
+
+        newly_covered = covered_after & ~covered_before
+        tracts = tracts.assign(
+            coverage_status=np.where(covered_before, "Existing", np.where(newly_covered, "New", "Uncovered"))
+        )
+
+        sites = tracts.iloc[selected][["GeoID", "city", "mu_income_bins_label", "num_pop", "centroid"]].copy()
+        sites.insert(0, "rank", np.arange(1, len(selected) + 1))
+        sites["weighted_gain"] = gains
+        # Population newly covered by each site, in selection order
+        covered = covered_before.copy()
+        population_gain = []
+        for i in selected:
+            cols = coverage.indices[coverage.indptr[i]:coverage.indptr[i + 1]]
+            population_gain.append(population[cols][~covered[cols]].sum())
+            covered[cols] = True
+        sites["population_gain"] = population_gain
+        sites = gpd.GeoDataFrame(sites, geometry="centroid", crs=tracts.crs)
+
+        total = population.sum() or 1.0
+        summary = {
+            "coverage_before": population[covered_before].sum() / total,
+            "coverage_after": population[covered_after].sum() / total,
+            "low_income_coverage_before": population[covered_before & low_income].sum() / (population[low_income].sum() or 1.0),
+            "low_income_coverage_after": population[covered_after & low_income].sum() / (population[low_income].sum() or 1.0),
+        }
+        return sites, tracts, summary
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def model_for(merged_gdf):
+    # Built once per loaded dataset and shared by all sessions
+    global _model
+    with _model_lock:
+        if _model is None or _model.merged_gdf is not merged_gdf:
+            _model = SitingModel(merged_gdf)
+        return _model
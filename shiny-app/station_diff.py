@@ -0,0 +1,173 @@
+import glob
+import os
+import re
+import threading
+
+from catalog import PARQUET_DIR, materialize_stations
+
+# Station snapshot diffs: a station's identity is its normalized address and
+# network, so it survives renames and re-numbered ids. Records with the same
+# identity within MATCH_RADIUS_M of each other (in either snapshot) are one site;
+# consecutive snapshots are hash-joined on the site fingerprint and the result is
+# a change log of added, removed and EVSE-count changes.
+CHANGES_PATH = os.path.join(PARQUET_DIR, "station_changes.parquet")
+
+# Coordinates of the same charger drift by a few metres to tens of metres between
+# snapshots; separate sites at one address (e.g. a campus) are further apart
+MATCH_RADIUS_M = 50
+EVSE_COLUMNS = ["ev_level1_evse_num", "ev_level2_evse_num", "ev_dc_fast_num"]
+DETAIL_COLUMNS = ["station_name", "street_address", "city", "ev_network", "GeoID"]
+CHANGE_TYPES = ["added", "removed", "evse_changed"]
+
+
+def normalize_address(addresses):
+    # "123 Main St." and "123  MAIN ST" are the same address
+    return (
+        addresses.fillna("").str.upper()
+        .str.replace(r"[^A-Z0-9]+", " ", regex=True)
+        .str.strip()
+    )
+
+
+def fingerprint(*snapshots):
+    # One fingerprint array per snapshot. Locations are compared by distance, not
+    # by rounding, so two records a metre apart never land in different cells.
+    # A site is keyed by its identity and its lowest station id (AFDC ids persist
+    # across snapshots), so the same site has the same fingerprint in every diff
+    import geopandas as gpd
+    import numpy as np
+    import pandas as pd
+    from scipy import sparse
+    from scipy.sparse.csgraph import connected_components
+    from scipy.spatial import cKDTree
+
+    from crosswalk import AREA_CRS
+
+    stations = pd.concat([s[["id", "street_address", "ev_network", "longitude", "latitude"]] for s in snapshots],
+                         ignore_index=True)
+    # Deterministic 64-bit hash (fixed key) of the record's own fields
+    identity = pd.util.hash_pandas_object(pd.DataFrame({
+        "address": normalize_address(stations["street_address"]).to_numpy(),
+        "network": stations["ev_network"].fillna("").to_numpy(),
+    }), index=False).to_numpy()
+
+    # Link records of the same identity within the radius (in metres, California
+    # Albers); connected groups of records are sites
+    points = gpd.GeoSeries.from_xy(stations["longitude"], stations["latitude"], crs="EPSG:4326").to_crs(AREA_CRS)
+    xy = np.column_stack([points.x.to_numpy(), points.y.to_numpy()])
+    located = np.flatnonzero(np.isfinite(xy).all(axis=1))
+    pairs = located[cKDTree(xy[located]).query_pairs(MATCH_RADIUS_M, output_type="ndarray")]
+    pairs = pairs[identity[pairs[:, 0]] == identity[pairs[:, 1]]]
+    graph = sparse.coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(stations),) * 2)
+    _, site = connected_components(graph, directed=False)
+
+    lowest_id = stations["id"].groupby(site).transform("min").to_numpy()
+    fingerprints = pd.util.hash_pandas_object(
+        pd.DataFrame({"identity": identity, "id": lowest_id}), index=False,
+    ).to_numpy()
+    return np.split(fingerprints, np.cumsum([len(s) for s in snapshots])[:-1])
+
+
+def snapshot_sites(stations, fingerprints):
+    # Several records can share a fingerprint (e.g. one per parking level); they are
+    # one site here, with the EVSE counts summed
+    sites = stations[DETAIL_COLUMNS + ["longitude", "latitude"]].copy()
+    sites[EVSE_COLUMNS] = stations[EVSE_COLUMNS].fillna(0).to_numpy()
+    sites["stations"] = 1
+    sites["fingerprint"] = fingerprints
+    aggregations = {c: "first" for c in DETAIL_COLUMNS + ["longitude", "latitude"]}
+    aggregations.update({c: "sum" for c in EVSE_COLUMNS + ["stations"]})
+    return sites.groupby("fingerprint", sort=False).agg(aggregations)
+
+
+def diff_snapshots(before, after, from_year, to_year):
+    import numpy as np
+
+    # Sites are fingerprinted over both snapshots together, then one outer hash
+    # join on the fingerprint
+    before_fingerprints, after_fingerprints = fingerprint(before, after)
+    merged = snapshot_sites(before, before_fingerprints).join(
+        snapshot_sites(after, after_fingerprints), how="outer", lsuffix="_before", rsuffix="_after",
+    )
+    in_before = merged["stations_before"].notna().to_numpy()
+    in_after = merged["stations_after"].notna().to_numpy()
+
+    evse_before = merged[[f"{c}_before" for c in EVSE_COLUMNS]].fillna(0).to_numpy()
+    evse_after = merged[[f"{c}_after" for c in EVSE_COLUMNS]].fillna(0).to_numpy()
+    evse_changed = (evse_before != evse_after).any(axis=1)
+
+    change = np.select(
+        [~in_before, ~in_after, evse_changed],
+        CHANGE_TYPES,
+        default="",
+    )
+    keep = change != ""
+    merged = merged[keep]
+
+    changes = merged.index.to_frame(index=False)
+    changes.insert(0, "from_year", from_year)
+    changes.insert(1, "to_year", to_year)
+    changes["change"] = change[keep]
+    # Describe a station by its latest record, or its last one if it was removed
+    for column in DETAIL_COLUMNS + ["longitude", "latitude"]:
+        changes[column] = merged[f"{column}_after"].fillna(merged[f"{column}_before"]).to_numpy()
+    for column in EVSE_COLUMNS + ["stations"]:
+        changes[f"{column}_before"] = merged[f"{column}_before"].fillna(0).to_numpy().astype(int)
+        changes[f"{column}_after"] = merged[f"{column}_after"].fillna(0).to_numpy().astype(int)
+    changes["evse_delta"] = (evse_after[keep] - evse_before[keep]).sum(axis=1).astype(int)
+    return changes
+
+
+def snapshot_paths(parquet_dir=PARQUET_DIR):
+    paths = glob.glob(os.path.join(parquet_dir, "stations_*.parquet"))
+    return dict(sorted((int(re.search(r"stations_(\d{4})", p).group(1)), p) for p in paths))
+
+
+def build_change_log(parquet_dir=PARQUET_DIR, path=CHANGES_PATH):
+    # Diff every pair of consecutive snapshot years
+    import pandas as pd
+
+    snapshots = snapshot_paths(parquet_dir)
+    years = list(snapshots)
+    # With fewer than two snapshots the log is empty but keeps its columns
+    empty = pd.DataFrame({c: pd.Series(dtype=float) for c in EVSE_COLUMNS + ["id", "longitude", "latitude"]})
+    empty[DETAIL_COLUMNS] = None
+    frames = [
+        diff_snapshots(pd.read_parquet(snapshots[a]), pd.read_parquet(snapshots[b]), a, b)
+        for a, b in zip(years, years[1:])
+    ] or [diff_snapshots(empty, empty, 0, 0)]
+    changes = pd.concat(frames, ignore_index=True)
+
+    tmp_path = f"{path}.tmp"
+    changes.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return changes
+
+
+def is_stale(parquet_dir=PARQUET_DIR, path=CHANGES_PATH):
+    if not os.path.exists(path):
+        return True
+    return any(os.path.getmtime(p) > os.path.getmtime(path) for p in snapshot_paths(parquet_dir).values())
+
+
+def load_changes(parquet_dir=PARQUET_DIR, path=CHANGES_PATH):
+    import pandas as pd
+
+    if not snapshot_paths(parquet_dir):
+        materialize_stations(out_dir=parquet_dir)
+    if is_stale(parquet_dir, path):
+        return build_change_log(parquet_dir, path)
+    return pd.read_parquet(path)
+
+
+_changes = None
+_changes_lock = threading.Lock()
+
+
+def get_changes():
+    # Read (or rebuilt when a snapshot is newer) once per process and shared by all sessions
+    global _changes
+    with _changes_lock:
+        if _changes is None or is_stale():
+            _changes = load_changes()
+        return _changes
@@ -0,0 +1,67 @@
+import threading
+
+from shared_dataset import as_geodataframe
+
+# Click-to-inspect: resolve a map click to a census tract with an STRtree over
+# the tract geometry (projected once to EPSG:3857, the CRS the maps are drawn in)
+
+DETAIL_COLUMNS = [
+    "year", "city", "num_pop", "mu_income", "mu_income_bins_label",
+    "unique_station_count", "ev_level2_evse_num", "ev_dc_fast_num",
+    "accessibility", "accessibility_bins",
+]
+
+
+def click_to_3857(click):
+    # Shiny's coordmap already reports data coordinates for matplotlib plots; fall
+    # back to mapping image pixels through the plot's domain/range otherwise
+    if click.get("x") is not None and click.get("y") is not None:
+        return click["x"], click["y"]
+    px, py = click["coords_img"]["x"], click["coords_img"]["y"]
+    domain, pixels = click["domain"], click["range"]
+    x = domain["left"] + (px - pixels["left"]) / (pixels["right"] - pixels["left"]) * (domain["right"] - domain["left"])
+    y = domain["bottom"] + (pixels["bottom"] - py) / (pixels["bottom"] - pixels["top"]) * (domain["top"] - domain["bottom"])
+    return x, y
+
+
+class TractLookup:
+    """STRtree point lookup from EPSG:3857 coordinates to a tract's rows across all years."""
+
+    def __init__(self, merged_gdf):
+        from shapely import STRtree
+
+        self.merged_gdf = merged_gdf
+        # Tract geometry is the same for every year, so index one row per GeoID
+        tracts = as_geodataframe(merged_gdf.drop_duplicates("GeoID")).to_crs(epsg=3857)
+        self.geoids = tracts["GeoID"].to_numpy()
+        self.tree = STRtree(tracts.geometry.to_numpy())
+        # Display table sorted by (GeoID, year) with positional row ranges per GeoID,
+        # so a hit is a slice rather than a scan of the full frame
+        columns = ["GeoID"] + [c for c in DETAIL_COLUMNS if c in merged_gdf.columns]
+        table = merged_gdf[columns].sort_values(["GeoID", "year"]).reset_index(drop=True)
+        # Tracts spanning several cities hold a list; show it as one string
+        table["city"] = table["city"].map(lambda c: ", ".join(c) if isinstance(c, list) else c)
+        self.table = table
+        self.rows = table.groupby("GeoID", sort=False).indices
+
+    def geoid_at(self, x, y):
+        from shapely import Point
+
+        hits = self.tree.query(Point(x, y), predicate="intersects")
+        return self.geoids[hits[0]] if len(hits) else None
+
+    def details(self, geoid):
+        return self.table.iloc[self.rows[geoid]]
+
+
+_lookup = None
+_lookup_lock = threading.Lock()
+
+
+def lookup_for(merged_gdf):
+    # Built once per loaded dataset and shared by all sessions
+    global _lookup
+    with _lookup_lock:
+        if _lookup is None or _lookup.merged_gdf is not merged_gdf:
+            _lookup = TractLookup(merged_gdf)
+        return _lookup